@@ -2,6 +2,8 @@
 ASGI config for myapp project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, e.g. ``uvicorn myapp.asgi:application``, for the
+async read views to share a worker between many slow clients.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
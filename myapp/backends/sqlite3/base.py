@@ -0,0 +1,58 @@
+from django.db.backends.sqlite3 import base
+
+""" 
+SQLite backend tuned for a web server with several concurrent writers.
+
+Every connection switches the database to WAL mode, so readers no longer
+block the writer, and waits up to `timeout` seconds for a lock instead of
+failing with "database is locked". Transactions start with BEGIN IMMEDIATE
+by default: a deferred transaction that reads before it writes cannot wait
+for the write lock and fails at once when another writer got there first.
+
+Extra OPTIONS:
+    'transaction_mode': 'DEFERRED', 'IMMEDIATE' (default) or 'EXCLUSIVE'
+    'init_command': SQL run on every new connection after the pragmas
+"""
+
+# Applied to every new connection, in this order
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),  # WAL is still safe against corruption
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -64000),  # in KiB
+    ('mmap_size', 128 * 1024 * 1024),
+)
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.transaction_mode = options.get(
+            'transaction_mode', 'IMMEDIATE').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ValueError(
+                f'transaction_mode must be one of {TRANSACTION_MODES}')
+        self.init_command = options.get('init_command')
+
+        # The extra options are not arguments of sqlite3.connect
+        kwargs = super().get_connection_params()
+        kwargs.pop('transaction_mode', None)
+        kwargs.pop('init_command', None)
+        kwargs.setdefault('timeout', 20)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        timeout = int(conn_params['timeout'] * 1000)
+        conn.execute(f'PRAGMA busy_timeout = {timeout}')
+        for pragma, value in PRAGMAS:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        if self.init_command:
+            conn.executescript(self.init_command)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
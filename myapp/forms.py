@@ -1,6 +1,12 @@
+import os
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from pages.catalogue import SORTS, DEFAULT_SORT
+from pages.images import image_root
 
 """ 
 Extension of the User Creation Form to add address fields.
@@ -35,3 +41,67 @@ class ReviewForm(forms.Form):
         required=False,
         widget=forms.Textarea()
     )  # text field for review details
+
+
+""" 
+Form validating the sort and filter options of the catalogue. Anything that
+is not one of the whitelisted options is rejected before a query is made.
+"""
+
+
+class CatalogueForm(forms.Form):
+    filter = forms.ChoiceField(
+        choices=[(sort, sort) for sort in SORTS], required=False)  # sort order
+    min_price = forms.DecimalField(
+        min_value=0, max_digits=6, decimal_places=2, required=False)
+    max_price = forms.DecimalField(
+        min_value=0, max_digits=6, decimal_places=2, required=False)
+    in_stock = forms.BooleanField(required=False)  # only items in stock
+    prefix = forms.CharField(max_length=120, required=False)  # name prefix
+
+    def clean_filter(self):
+        return self.cleaned_data.get('filter') or DEFAULT_SORT
+
+
+""" 
+Form for the search box
+"""
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField(max_length=100, required=False)  # search terms
+    page = forms.IntegerField(min_value=1, max_value=1000, required=False)
+
+    def clean_page(self):
+        return self.cleaned_data.get('page') or 1
+
+
+""" 
+Rejects picture paths outside the picture root or of missing files
+"""
+
+
+def validate_picture(picture):
+    try:
+        path = safe_join(image_root(), picture)
+    except SuspiciousFileOperation:
+        raise forms.ValidationError('Picture outside the picture root.')
+    if not os.path.isfile(path):
+        raise forms.ValidationError('No such picture.')
+
+
+""" 
+Fields of one row of a catalogue import. pages.imports cleans rows with
+these fields directly, so validation belongs on the fields, not in
+clean methods.
+"""
+
+
+class ItemImportForm(forms.Form):
+    name = forms.CharField(max_length=120)  # matches existing items
+    price = forms.DecimalField(min_value=0, max_digits=6, decimal_places=2)
+    description = forms.CharField(max_length=430, required=False)
+    stock = forms.IntegerField(min_value=0, required=False)  # units in stock
+    # Path of the picture inside the picture root (ITEM_IMAGE_ROOT)
+    picture = forms.CharField(max_length=100, required=False,
+                              validators=[validate_picture])
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,9 +24,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'o-a1j700bcl4-z+d4rott0!-^@uqwr_4(rbuti+jv76kn9groh'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DEBUG', 'True') == 'True'
 
-ALLOWED_HOSTS = []
+#comma separated, required once DEBUG=False, e.g. ALLOWED_HOSTS=shop.example.com
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get(
+    'ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',') if host.strip()]
 
 
 # Application definition
@@ -40,10 +43,12 @@ INSTALLED_APPS = [
     'django_extensions',
 
     #Own applications
-    'pages', #app for the views and models
+    'pages.apps.PagesConfig', #app for the views and models
 ]
 
 MIDDLEWARE = [
+    'pages.middleware.StaticAssetMiddleware', #collected static files
+    'pages.middleware.RequestStatsMiddleware', #query count and latency stats
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,12 +60,19 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'myapp.urls'
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'pages.stats.TimedDjangoTemplates', #times every render
         'DIRS': [BASE_DIR / 'templates'], #Templates where HTML files are located
-        'APP_DIRS': True,
         'OPTIONS': {
+            #templates are parsed once per process outside of DEBUG
+            'loaders': TEMPLATE_LOADERS if DEBUG else [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -77,13 +89,74 @@ WSGI_APPLICATION = 'myapp.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Chosen with environment variables, SQLite unless DB_ENGINE=postgresql:
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT  connection details
+#   DB_CONN_MAX_AGE  seconds a connection is reused, 0 closes it per request
+#   DB_POOLER=pgbouncer  when DB_HOST is a pgbouncer in transaction pooling
+#   DB_TIMEOUT  seconds an SQLite writer waits for the lock
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'shop'),
+            'USER': os.environ.get('DB_USER', 'shop'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Persistent connections, one per worker thread
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            # Server side cursors do not survive transaction pooling
+            'DISABLE_SERVER_SIDE_CURSORS':
+                os.environ.get('DB_POOLER') == 'pgbouncer',
+            'OPTIONS': {'connect_timeout': 5},
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            # WAL, busy timeout and BEGIN IMMEDIATE, see the backend
+            'ENGINE': 'myapp.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+            'OPTIONS': {
+                'timeout': float(os.environ.get('DB_TIMEOUT', 20)),
+                'transaction_mode': 'IMMEDIATE',
+            },
+            # File based test database so that threaded tests share the data
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop',
+    },
+    #rendered fragments of the templates ({% cache %} tags)
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+    },
 }
 
+ITEM_CACHE_TIMEOUT = 60 * 15  # Seconds an item page stays cached
+FRAGMENT_CACHE_TIMEOUT = 60 * 60  # Seconds a rendered fragment stays cached
+
+
+# Requests kept per URL name for the percentiles at /stats/
+REQUEST_STATS_WINDOW = 1000
+
+
+# Cart storage of logged in users, anonymous carts always live in the session
+CART_STORAGE = 'pages.cart.SessionCart'
+CART_FLUSH_INTERVAL = 60 * 5  # Seconds before a buffered cart is written back
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -121,14 +194,42 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
-STATIC_URL = '/static/'
+#A CDN in front of the site can be used by pointing STATIC_URL at it
+STATIC_URL = os.environ.get('STATIC_URL', '/static/')
 
 #Where static files are saved
 STATICFILES_DIRS = [
     BASE_DIR/'static',
 ]
 
-STATIC_ROOT = BASE_DIR/'static_root' #probably not needed
+#collectstatic output: bundled CSS, hashed names, .gz/.br variants and the
+#manifest resolved by {% static %} (see pages/staticfiles.py)
+STATIC_ROOT = BASE_DIR/'static_root'
+STATICFILES_STORAGE = 'pages.staticfiles.ShopStaticStorage'
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'pages.staticfiles.BundleFinder', #per page CSS bundles
+]
+STATIC_BUNDLE_ROOT = BASE_DIR/'static_bundles' #built CSS bundles
+
+#Item pictures, uploads land where Item.get_image serves them from
+ITEM_IMAGE_ROOT = BASE_DIR/'static'/'items'
+MEDIA_ROOT = ITEM_IMAGE_ROOT
+
+#Resize item pictures on a background thread (see pages/images.py)
+IMAGE_DERIVATIVES_ASYNC = True
+
+#Background jobs: 'thread' (web process pool plus run_workers for retries),
+#'worker' (run_workers only) or 'eager' (inline, for tests). See pages/tasks.py
+TASK_RUNNER = 'thread'
+
+#Emails go to the console until an SMTP server is configured
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+#Search index: 'fts5', 'python' or 'auto' (FTS5 where SQLite supports it)
+SEARCH_BACKEND = 'auto'
+SEARCH_INDEX_PATH = BASE_DIR/'search_index.pickle' #used by the python backend
 
 #Redirect urls after successful login and logout
 LOGIN_REDIRECT_URL = 'home'
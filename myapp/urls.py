@@ -26,10 +26,13 @@ urlpatterns = [
     path('signup/', signup, name='signup'), #user signup page
     path('my-cart/', cart_view, name='cart'), #user cart page
     path('add-to-cart/<int:item_id>/', add_cart, name='add to cart'), #add item to cart url
-    path('item/<int:item_id>/', item_view), #page for single item details
-    path('remove-item/<int:item_id>/', remove_item), #remove item from cart
-    path('checkout/', checkout_view),  #checkout page
-    path('my-orders', orders_view), #user orders page
-    path('review-item/<int:item_id>/', review_view), #review item page
+    path('item/<int:item_id>/', item_view, name='item'), #page for single item details
+    path('remove-item/<int:item_id>/', remove_item, name='remove item'), #remove item from cart
+    path('checkout/', checkout_view, name='checkout'),  #checkout page
+    path('my-orders', orders_view, name='orders'), #user orders page
+    path('review-item/<int:item_id>/', review_view, name='review item'), #review item page
+    path('search/', search_view, name='search'), #search results page
+    path('stats/', stats_view, name='stats'), #request stats for staff
+    path('exports/<slug:name>.<slug:format>', export_view, name='export'), #reports for staff
 ]   
 
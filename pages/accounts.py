@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Profile
+from .tasks import enqueue, set_up_profile
+
+'''
+Registration of new users.
+'''
+
+
+"""
+Creates a user with their profile in one transaction: one INSERT each and
+a single password hash. The address and the welcome email are set up by a
+queued job.
+"""
+
+
+def register(username, password, email='', first_name='', last_name='',
+             birth_date=None, **address):
+    user = User(username=username, email=email, first_name=first_name,
+                last_name=last_name)
+    user.set_password(password)
+    # Saved with the user by the create_user_profile receiver
+    user.profile = Profile(birth_date=birth_date)
+
+    with transaction.atomic():
+        user.save()
+        enqueue(set_up_profile, user.profile.pk, address,
+                key=f'profile-setup:{user.pk}')
+    return user
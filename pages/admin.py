@@ -1,11 +1,211 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .catalogue import PREFIX_END
 from .models import *
 
-# Register your models here.
-admin.site.register(Profile)
-admin.site.register(Address)
-admin.site.register(CartDetails)
-admin.site.register(Item)
-admin.site.register(Order)
-admin.site.register(OrderDetails)
-admin.site.register(Review)
\ No newline at end of file
+'''
+Admin of the shop. Every changelist selects the relations its __str__ and
+columns walk so a page costs the same handful of queries at any size, offers
+only case sensitive prefix or exact searches and filters on indexed
+columns, and picks related rows by id instead of rendering a select of every
+row. A ^ search field is matched with a range on its index rather than
+Django's istartswith, an UPPER() or LIKE which no plain index serves.
+The big tables are counted from the database statistics.
+'''
+
+# Tables estimated to hold fewer rows than this are counted exactly
+ESTIMATE_THRESHOLD = 10000
+
+
+"""
+Returns the approximate number of rows of the table of a model, or None
+where the database keeps no cheap estimate
+"""
+
+
+def estimated_count(model, using='default'):
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Kept up to date by autovacuum, -1 if never analyzed
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [table])
+        elif connection.vendor == 'sqlite':
+            # The largest rowid comes from the end of the primary key b-tree
+            cursor.execute(
+                f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+"""
+Paginator counting unfiltered changelists from the table statistics instead
+of a COUNT(*) over the whole table. Filtered lists and small tables are
+still counted exactly.
+"""
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimated_count(self.object_list.model,
+                                       self.object_list.db)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+"""
+Filter on a one letter code with a fixed list of values. Django's filter
+for a field without choices would read the values with a SELECT DISTINCT.
+"""
+
+
+class CodeFilter(admin.SimpleListFilter):
+    codes = []  # (code, label) pairs
+
+    def lookups(self, request, model_admin):
+        return self.codes
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(**{self.parameter_name: self.value()})
+
+
+class AddressTypeFilter(CodeFilter):
+    title = 'type'
+    parameter_name = 'address_type'
+    codes = [('H', 'Home'), ('W', 'Work'), ('A', 'Temporary')]
+
+
+class OrderStatusFilter(CodeFilter):
+    title = 'status'
+    parameter_name = 'status'
+    codes = [('P', 'Processing'), ('S', 'Shipped'), ('D', 'Delivered')]
+
+
+"""
+Settings shared by the admins of the large tables
+"""
+
+
+class ShopAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # no second COUNT(*) when filtering
+    list_per_page = 100
+    search_id_fields = ()  # integer keys, only searched for numbers
+
+    """ 
+    Returns the rows matching the whole term, which the changelist and the
+    autocomplete widgets both search with. ^field matches the fields starting
+    with the term, other search fields are exact lookups.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        lookups = []
+        for field in self.get_search_fields(request):
+            if field.startswith('^'):
+                lookups.append({f'{field[1:]}__gte': term,
+                                f'{field[1:]}__lt': term + PREFIX_END})
+            else:
+                lookups.append({field: term})
+        # An exact lookup on an integer fails on anything but a number
+        if term.isdigit():
+            lookups += [{field: term} for field in self.search_id_fields]
+
+        # Every field is searched on its own and the keys of the matches
+        # combined with a UNION, since an OR of columns of joined tables
+        # is answered by reading the whole table
+        matches = [self.model._default_manager.filter(**lookup).values('pk')
+                   for lookup in lookups]
+        return queryset.filter(pk__in=matches[0].union(*matches[1:])
+                               if len(matches) > 1 else matches[0]), False
+
+
+@admin.register(Profile)
+class ProfileAdmin(ShopAdmin):
+    list_display = ('__str__', 'birth_date')
+    list_select_related = ('user',)
+    search_fields = ('^user__username',)  # auth_user username key
+    raw_id_fields = ('user',)
+
+
+@admin.register(Address)
+class AddressAdmin(ShopAdmin):
+    list_display = ('__str__', 'city', 'country', 'zip_code')
+    list_select_related = ('user__user',)
+    list_filter = (AddressTypeFilter,)
+    search_fields = ('^user__user__username', '^zip_code')
+    raw_id_fields = ('user',)
+
+
+@admin.register(CartDetails)
+class CartDetailsAdmin(ShopAdmin):
+    list_display = ('__str__', 'item', 'quantity')
+    list_select_related = ('user', 'item')
+    search_fields = ('^user__username',)
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('item',)
+
+
+@admin.register(Item)
+class ItemAdmin(ShopAdmin):
+    list_display = ('name', 'price', 'quantity_stock', 'quantity_order',
+                    'review_count', 'rating_average')
+    search_fields = ('^name',)  # item_name_idx
+    readonly_fields = ('version', 'modified')
+    ordering = ('name', 'item_id')  # item_name_idx
+
+
+@admin.register(Order)
+class OrderAdmin(ShopAdmin):
+    list_display = ('order_id', '__str__', 'status', 'total', 'line_count')
+    list_select_related = ('user__user',)
+    list_filter = (OrderStatusFilter,)  # order_status_idx
+    search_fields = ('^user__user__username',)
+    search_id_fields = ('order_id__exact',)
+    raw_id_fields = ('user',)
+    ordering = ('-order_id',)
+
+
+@admin.register(OrderDetails)
+class OrderDetailsAdmin(ShopAdmin):
+    list_display = ('__str__', 'item_name', 'unit_price', 'quantity')
+    search_fields = ('^item__name',)  # item_name_idx
+    search_id_fields = ('order_id__exact',)
+    raw_id_fields = ('order_id',)
+    autocomplete_fields = ('item',)
+    ordering = ('-order_detail_id',)
+
+
+@admin.register(Review)
+class ReviewAdmin(ShopAdmin):
+    list_display = ('item', 'user', 'rating', 'modified')
+    list_select_related = ('item', 'user')
+    search_fields = ('^item__name', '^user__username')
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('item',)
+
+
+@admin.register(Job)
+class JobAdmin(ShopAdmin):
+    list_display = ('task', 'status', 'attempts', 'run_at', 'last_error')
+    list_filter = ('status',)  # job_due_idx
+    search_fields = ('key__exact',)  # unique
+    ordering = ('-job_id',)
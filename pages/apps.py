@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class PagesConfig(AppConfig):
     name = 'pages'
+
+    def ready(self):
+        from . import signals, stats  # connects the receivers
+
+        post_migrate.connect(signals.create_search_table, sender=self)
+        connection_created.connect(stats.install_query_wrapper)
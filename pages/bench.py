@@ -0,0 +1,502 @@
+import http.client
+import io
+import random
+import re
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from .catalogue import SORTS
+from .models import Address, Item, Order, OrderDetails, Profile, Review
+from .stock import OutOfStock, reserve_stock, run_with_retry
+
+'''
+Helpers for the benchmark commands: a throwaway database, synthetic data,
+timing and a load generator driving the shop's URLs. Benchmarks never touch
+the development database.
+'''
+
+USERNAME = 'bench'  # Prefix of the synthetic usernames
+PASSWORD = 'benchmark'  # Password of every synthetic user
+
+# Words the synthetic item names and descriptions are made of
+VOCABULARY = [
+    'cotton', 'linen', 'wool', 'denim', 'leather', 'canvas', 'silk', 'knit',
+    'shirt', 'shorts', 'scarf', 'cap', 'shoes', 'notebook', 'jacket', 'socks',
+    'red', 'blue', 'black', 'white', 'green', 'grey', 'navy', 'olive',
+    'classic', 'slim', 'relaxed', 'oversized', 'cropped', 'vintage', 'sport',
+    'summer', 'winter', 'travel', 'office', 'weekend', 'everyday', 'limited',
+] + [f'sku{number}' for number in range(2000)]
+
+
+"""
+Creates a test database for the duration of the block and destroys it
+afterwards, like the test runner does. The hosts of the test client and of
+the local servers are allowed meanwhile.
+"""
+
+
+@contextmanager
+def test_database(verbosity=0):
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    hosts = [*settings.ALLOWED_HOSTS, 'testserver', 'localhost', '127.0.0.1']
+    try:
+        with override_settings(ALLOWED_HOSTS=hosts):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+"""
+Returns a random text of the given number of words
+"""
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(count))
+
+
+"""
+Bulk inserts count synthetic items, bypassing the Item signals
+"""
+
+
+def seed_items(count, batch_size=5000, seed=0, stock=None):
+    rng = random.Random(seed)
+    for start in range(0, count, batch_size):
+        Item.objects.bulk_create([
+            Item(name=words(rng, 3).title(),
+                 price=rng.randint(100, 99999) / 100,
+                 description=words(rng, 25),
+                 quantity_stock=stock if stock is not None
+                 else rng.randint(0, 50))
+            for _ in range(min(batch_size, count - start))
+        ])
+
+
+"""
+Bulk inserts a whole shop into an empty database: users with their profile
+and address, items with plenty of stock, reviews and past orders. Returns
+the ids of the users and of the items.
+"""
+
+
+def seed_shop(users=100, items=1000, reviews=2000, orders=500,
+              lines_per_order=3, batch_size=5000, seed=0):
+    rng = random.Random(seed)
+    seed_items(items, batch_size, seed, stock=10 ** 6)
+    item_ids = list(Item.objects.values_list('item_id', flat=True))
+
+    # Hashing is slow on purpose, so every user shares the same hash
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([
+        User(username=f'{USERNAME}{number}', password=password)
+        for number in range(users)
+    ], batch_size)
+    user_ids = list(User.objects.filter(
+        username__startswith=USERNAME).values_list('pk', flat=True))
+
+    # bulk_create skips the post_save signal creating the profiles
+    Profile.objects.bulk_create(
+        [Profile(user_id=user_id) for user_id in user_ids], batch_size)
+    profile_ids = list(Profile.objects.filter(
+        user__username__startswith=USERNAME).values_list('pk', flat=True))
+    Address.objects.bulk_create([
+        Address(user_id=profile_id, address_line_1=words(rng, 2),
+                city='Manila', country='Philippines', zip_code='1000')
+        for profile_id in profile_ids
+    ], batch_size)
+
+    # One review per user and item at most
+    pairs = set()
+    while len(pairs) < min(reviews, users * items):
+        pairs.add((rng.choice(item_ids), rng.choice(user_ids)))
+    Review.objects.bulk_create([
+        Review(item_id=item_id, user_id=user_id, rating=rng.randint(1, 5),
+               review_text=words(rng, 12))
+        for item_id, user_id in pairs
+    ], batch_size)
+    call_command('rebuild_ratings', stdout=io.StringIO())
+
+    now = timezone.now()
+    Order.objects.bulk_create([
+        Order(user_id=rng.choice(profile_ids),
+              status=rng.choice('PSD'),
+              created_date=now - timedelta(minutes=rng.randint(0, 10 ** 6)))
+        for _ in range(orders)
+    ], batch_size)
+    # SQLite does not return the primary keys of bulk inserts
+    order_ids = Order.objects.values_list('order_id', flat=True)
+    # Lines carry the price and name snapshots checkout would store
+    snapshots = {item_id: (price, name) for item_id, price, name in
+                 Item.objects.values_list('item_id', 'price', 'name')}
+    OrderDetails.objects.bulk_create([
+        OrderDetails(order_id_id=order_id, item_id=item_id,
+                     quantity=rng.randint(1, 3),
+                     unit_price=snapshots[item_id][0],
+                     item_name=snapshots[item_id][1])
+        for order_id in order_ids.iterator()
+        for item_id in rng.sample(item_ids, min(lines_per_order, items))
+    ], batch_size)
+    call_command('backfill_order_totals', stdout=io.StringIO())
+
+    return user_ids, item_ids
+
+
+"""
+Calls func once per argument and returns the latencies in milliseconds
+"""
+
+
+def time_calls(func, arguments):
+    latencies = []
+    for argument in arguments:
+        started = time.perf_counter()
+        func(argument)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+"""
+Summarises latencies in milliseconds as mean and percentiles
+"""
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered), 3),
+        'p50_ms': round(percentile(0.50), 3),
+        'p95_ms': round(percentile(0.95), 3),
+        'p99_ms': round(percentile(0.99), 3),
+    }
+
+
+"""
+Reserves one unit of an item `attempts` times from `threads` threads with
+a connection each, all contending for the same row. Returns the reserved
+orders per second with the counts of reserved and refused attempts and
+the latencies of the attempts.
+"""
+
+
+def run_reservations(item_id, attempts, threads=8):
+    results = []
+
+    def reserve(count):
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                try:
+                    run_with_retry(reserve_stock, {item_id: 1})
+                    reserved = True
+                except OutOfStock:
+                    reserved = False
+                results.append(
+                    (reserved, (time.perf_counter() - started) * 1000))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=reserve, args=(
+        attempts // threads + (number < attempts % threads),))
+        for number in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    reserved = sum(1 for ok, _ in results if ok)
+    return {
+        'reservations_per_s': round(reserved / elapsed, 1),
+        'reserved': reserved,
+        'refused': len(results) - reserved,
+        'failed': attempts - len(results),
+        'latency': summarize([latency for _, latency in results]),
+    }
+
+
+# URL routes driven by the load generator. Each returns the paths requested
+# for one sample: the last one is timed, the ones before it prepare it.
+ROUTES = {
+    'index': lambda item_id, rng: [f'/?filter={rng.choice(list(SORTS))}'],
+    'item_view': lambda item_id, rng: [f'/item/{item_id}/'],
+    'add_cart': lambda item_id, rng: [f'/add-to-cart/{item_id}/'],
+    'cart_view': lambda item_id, rng: ['/my-cart/'],
+    'checkout_view': lambda item_id, rng: [f'/add-to-cart/{item_id}/',
+                                           '/checkout/'],
+    'orders_view': lambda item_id, rng: ['/my-orders'],
+    'profile_view': lambda item_id, rng: ['/profile/'],
+}
+
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+_DURATIONS = re.compile(r'(\w+);dur=([\d.]+)')
+
+
+"""
+Returns the query count RequestStatsMiddleware put in the Server-Timing
+header of a response
+"""
+
+
+def query_count(server_timing):
+    match = _QUERIES.search(server_timing or '')
+    return int(match.group(1)) if match else 0
+
+
+"""
+Returns the {metric: milliseconds} of a Server-Timing header
+"""
+
+
+def durations(server_timing):
+    return {name: float(duration)
+            for name, duration in _DURATIONS.findall(server_timing or '')}
+
+
+"""
+Returns test clients logged in as the given users
+"""
+
+
+def logged_in_clients(user_ids):
+    clients = []
+    for user in User.objects.filter(pk__in=user_ids):
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        clients.append(client)
+    return clients
+
+
+"""
+Summarises the samples of one route: throughput over the elapsed seconds,
+latency percentiles, queries per request and server errors
+"""
+
+
+def report(latencies, queries, errors, elapsed):
+    return {
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency': summarize(latencies),
+        'queries': {'mean': round(statistics.mean(queries), 2),
+                    'max': max(queries)},
+        'errors': errors,
+    }
+
+
+"""
+Requests a route through the test client, one request at a time
+"""
+
+
+def run_client(route, clients, item_ids, requests, seed=0):
+    rng = random.Random(seed)
+    latencies, queries, errors = [], [], 0
+    for number in range(requests):
+        client = clients[number % len(clients)]
+        *setup, path = ROUTES[route](rng.choice(item_ids), rng)
+        for url in setup:
+            client.get(url)
+
+        started = time.perf_counter()
+        response = client.get(path)
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(query_count(response.get('Server-Timing')))
+        errors += response.status_code >= 500
+
+    return report(latencies, queries, errors, sum(latencies) / 1000)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchWSGIServer(ThreadedWSGIServer):
+    request_queue_size = 1024  # room for every concurrent client
+
+
+"""
+Serves the project over HTTP on a free local port for the duration of the
+block and yields the (host, port) address
+"""
+
+
+@contextmanager
+def live_server():
+    server = BenchWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+"""
+Serves the project's ASGI application with uvicorn on a free local port for
+the duration of the block and yields the (host, port) address
+"""
+
+
+@contextmanager
+def asgi_server():
+    import uvicorn  # only needed by the ASGI benchmark
+    from django.core.asgi import get_asgi_application
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(
+        get_asgi_application(), lifespan='off', log_level='warning',
+        backlog=1024))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]},
+                              daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield sock.getsockname()
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+
+"""
+Returns the session cookie values of the given test clients
+"""
+
+
+def session_cookies(clients):
+    return [client.cookies[settings.SESSION_COOKIE_NAME].value
+            for client in clients]
+
+
+"""
+Sends a GET over a fresh connection and returns the status and the
+Server-Timing header
+"""
+
+
+def _get(address, path, cookie):
+    conn = http.client.HTTPConnection(*address, timeout=60)
+    try:
+        conn.request('GET', path, headers={
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={cookie}'})
+        response = conn.getresponse()
+        response.read()
+        return response.status, response.getheader('Server-Timing')
+    finally:
+        conn.close()
+
+
+"""
+Requests a route over HTTP from `concurrency` threads at once, each logged
+in as a different user, and measures throughput over the wall clock time
+"""
+
+
+def run_http(route, address, cookies, item_ids, requests, concurrency=8,
+             seed=0):
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        cookie = cookies[number % len(cookies)]
+        samples = []
+        for _ in range(number, requests, concurrency):
+            *setup, path = ROUTES[route](rng.choice(item_ids), rng)
+            for url in setup:
+                _get(address, url, cookie)
+
+            started = time.perf_counter()
+            status, server_timing = _get(address, path, cookie)
+            samples.append(((time.perf_counter() - started) * 1000,
+                            query_count(server_timing), status >= 500))
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        samples = [sample for samples in
+                   executor.map(worker, range(concurrency))
+                   for sample in samples]
+    elapsed = time.perf_counter() - started
+
+    # Setup requests are part of the wall clock time of checkout_view
+    return report([latency for latency, _, _ in samples],
+                  [queries for _, queries, _ in samples],
+                  sum(error for _, _, error in samples), elapsed)
+
+
+"""
+Overrides the template settings for a render benchmark: with cached=False
+templates are parsed on every render and {% cache %} fragments are never
+stored, with cached=True the cached loader and the fragment cache are used
+"""
+
+
+def render_settings(cached):
+    loaders = settings.TEMPLATE_LOADERS
+    if cached:
+        loaders = [('django.template.loaders.cached.Loader', loaders)]
+    templates = [{**engine, 'OPTIONS': {**engine['OPTIONS'],
+                                        'loaders': loaders}}
+                 for engine in settings.TEMPLATES]
+
+    caches = dict(settings.CACHES)
+    if not cached:
+        caches['template_fragments'] = {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    return override_settings(TEMPLATES=templates, CACHES=caches)
+
+
+"""
+Requests a route through the test client and reports the share of the
+server time spent rendering templates, from the Server-Timing header. Every
+distinct path is requested once before timing so caches are warm.
+"""
+
+
+def run_render(route, item_ids, requests, seed=0):
+    rng = random.Random(seed)
+    client = Client(raise_request_exception=False)
+    paths = [ROUTES[route](rng.choice(item_ids), rng)[-1]
+             for _ in range(requests)]
+    for path in dict.fromkeys(paths):
+        client.get(path)
+
+    totals, templates = [], []
+    for path in paths:
+        timings = durations(client.get(path).get('Server-Timing'))
+        totals.append(timings.get('total', 0.0))
+        templates.append(timings.get('tpl', 0.0))
+
+    return {
+        'latency': summarize(totals),
+        'template': summarize(templates),
+        'template_share': round(sum(templates) / sum(totals), 3)
+        if sum(totals) else None,
+    }
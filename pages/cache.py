@@ -0,0 +1,142 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery
+from django.http import Http404
+
+from .models import Item, Review
+
+'''
+Cached data for the item page. The item and its reviews are stored under a
+key per item_id and dropped by the signal receivers in pages.signals
+whenever the item or one of its reviews changes.
+
+The rendered fragments of the item pages ({% cache %} tags) are not
+invalidated: they are keyed on Item.version, which every change to what they
+show bumps, so stale fragments are never read again and simply expire.
+
+The pages also carry HTTP validators (ETag and Last-Modified) derived from
+the modification times of the items and reviews, so that repeat requests
+are answered with a 304 after a single query (see async_condition).
+'''
+
+# How long an item page stays cached when nothing invalidates it (seconds)
+ITEM_CACHE_TIMEOUT = getattr(settings, 'ITEM_CACHE_TIMEOUT', 60 * 15)
+
+# How long a rendered fragment of an item stays cached (seconds)
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+
+CATALOGUE_VERSION_KEY = 'catalogue-version'  # Changed by every item deletion
+
+
+"""
+Returns the cache key for the page of an item
+"""
+
+
+def item_cache_key(item_id):
+    return f'item-page:{item_id}'
+
+
+"""
+Loads the item and its reviews (with their users) in two queries
+"""
+
+
+def load_item_page(item_id):
+    try:
+        item = Item.objects.get(item_id=item_id)
+    except Item.DoesNotExist:
+        raise Http404('No such item.')
+
+    reviews = list(Review.objects.filter(item=item).select_related('user'))
+    return item, reviews
+
+
+"""
+Returns the item and its reviews from the cache, loading them on a miss
+"""
+
+
+def get_item_page(item_id):
+    key = item_cache_key(item_id)
+    page = cache.get(key)
+    if page is None:
+        page = load_item_page(item_id)
+        cache.set(key, page, ITEM_CACHE_TIMEOUT)
+    return page
+
+
+"""
+Drops the cached page of an item
+"""
+
+
+def invalidate_item(item_id):
+    cache.delete(item_cache_key(item_id))
+
+
+"""
+Drops the cached pages of many items at once, for bulk changes that skip
+the signals
+"""
+
+
+def invalidate_items(item_ids):
+    cache.delete_many([item_cache_key(item_id) for item_id in item_ids])
+
+
+"""
+Returns the ETag and last modification time of a page given the time and
+state it was derived from. The user is part of the ETag since every page
+greets them by name.
+"""
+
+
+def page_validators(request, modified, *state):
+    content = repr((modified, *state, request.user.pk)).encode()
+    return f'"{hashlib.sha1(content).hexdigest()[:16]}"', modified
+
+
+"""
+Returns the version of the catalogue kept in the cache, a random value
+replaced whenever an item is deleted (see pages.signals), which the
+modification times cannot show
+"""
+
+
+def catalogue_version():
+    return cache.get_or_set(CATALOGUE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def bump_catalogue_version():
+    cache.set(CATALOGUE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+"""
+Validators of the catalogue: the last change of any item, read from the
+end of the index on Item.modified, and the catalogue version for deletions
+"""
+
+
+def catalogue_validators(request, *args, **kwargs):
+    modified = Item.objects.aggregate(modified=Max('modified'))['modified']
+    return page_validators(request, modified, catalogue_version())
+
+
+"""
+Validators of an item page: the last change of the item or of its reviews.
+Missing items have none, so the view answers with a 404.
+"""
+
+
+def item_validators(request, item_id, *args, **kwargs):
+    reviews = Review.objects.filter(item=OuterRef('pk')).order_by('-modified')
+    row = Item.objects.filter(item_id=item_id).annotate(
+        reviews_modified=Subquery(reviews.values('modified')[:1])).values_list(
+        'modified', 'reviews_modified').first()
+    if row is None:
+        return None, None
+    return page_validators(request, max(filter(None, row)), item_id)
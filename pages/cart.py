@@ -0,0 +1,239 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import CartDetails, Item
+
+'''
+Cart storage. Views never touch CartDetails directly but go through the cart
+returned by get_cart, which is a SessionCart for anonymous users and the
+class named by the CART_STORAGE setting for logged in users.
+'''
+
+SESSION_KEY = 'cart'  # Session entry holding the buffered cart
+
+# Seconds after which a buffered cart of a logged in user is written back
+CART_FLUSH_INTERVAL = getattr(settings, 'CART_FLUSH_INTERVAL', 60 * 5)
+
+
+"""
+Interface shared by the cart storages
+"""
+
+
+class BaseCart:
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+
+    """
+    Returns the {item_id: quantity} of everything in the cart
+    """
+
+    def quantities(self):
+        raise NotImplementedError
+
+    """
+    Adds quantity of the item to the cart
+    """
+
+    def add(self, item_id, quantity=1):
+        raise NotImplementedError
+
+    """
+    Takes one of the item out of the cart, dropping it at zero
+    """
+
+    def remove(self, item_id):
+        raise NotImplementedError
+
+    """
+    Writes the cart to CartDetails so that checkout can read it
+    """
+
+    def flush(self):
+        pass
+
+    """
+    Forgets the cart once its contents have been ordered
+    """
+
+    def clear(self):
+        pass
+
+    """
+    Returns a list of (item, quantity, subtotal) and the cart total
+    """
+
+    def summary(self):
+        quantities = self.quantities()
+        items = Item.objects.in_bulk(list(quantities))
+
+        lines = [(items[item_id], quantity, items[item_id].price * quantity)
+                 for item_id, quantity in quantities.items()
+                 if item_id in items]
+        return lines, sum(subtotal for _, _, subtotal in lines)
+
+
+"""
+Cart that reads and writes CartDetails on every change
+"""
+
+
+class DatabaseCart(BaseCart):
+
+    def quantities(self):
+        return dict(CartDetails.objects.filter(
+            user=self.user).values_list('item_id', 'quantity'))
+
+    def add(self, item_id, quantity=1):
+        cart, created = CartDetails.objects.get_or_create(
+            item_id=item_id, user=self.user,
+            defaults={'quantity': quantity})
+        if not created:
+            cart.quantity += quantity
+            cart.save()
+
+    def remove(self, item_id):
+        cart = CartDetails.objects.filter(
+            user=self.user, item_id=item_id).first()
+        if cart is None:
+            return
+        if cart.quantity <= 1:
+            cart.delete()
+        else:
+            cart.quantity -= 1
+            cart.save()
+
+    def summary(self):
+        lines, total = CartDetails.objects.filter(user=self.user).summary()
+        return [(line.item, line.quantity, line.subtotal)
+                for line in lines], total
+
+
+"""
+Cart buffered in the session. Changes stay in the session and are written to
+CartDetails only at login, at checkout or when the last write is older than
+CART_FLUSH_INTERVAL, so adding to the cart costs no CartDetails queries.
+Only the lines changed in the session are written, so a stale session never
+undoes what another device did to the other lines.
+"""
+
+
+class SessionCart(BaseCart):
+
+    def __init__(self, request):
+        super().__init__(request)
+        owner = self.user.pk if self.user.is_authenticated else None
+        self.state = request.session.get(SESSION_KEY)
+
+        # Start from the stored cart the first time a user's cart is used
+        if self.state is None or self.state['owner'] != owner:
+            self.state = {
+                'owner': owner,
+                'lines': self._load() if owner is not None else {},
+                'changed': [],  # item ids changed since the last flush
+                'flushed': time.time(),
+            }
+            self._save()
+
+    def _load(self):
+        return {str(item_id): quantity for item_id, quantity in
+                CartDetails.objects.filter(
+                    user=self.user).values_list('item_id', 'quantity')}
+
+    def _save(self):
+        self.request.session[SESSION_KEY] = self.state
+
+    def _changed(self, item_id):
+        if str(item_id) not in self.state['changed']:
+            self.state['changed'].append(str(item_id))
+        self._save()
+        if time.time() - self.state['flushed'] > CART_FLUSH_INTERVAL:
+            self.flush()
+
+    def quantities(self):
+        return {int(item_id): quantity
+                for item_id, quantity in self.state['lines'].items()}
+
+    def add(self, item_id, quantity=1):
+        lines = self.state['lines']
+        lines[str(item_id)] = lines.get(str(item_id), 0) + quantity
+        self._changed(item_id)
+
+    def remove(self, item_id):
+        lines = self.state['lines']
+        if str(item_id) not in lines:
+            return
+        lines[str(item_id)] -= 1
+        if lines[str(item_id)] <= 0:
+            del lines[str(item_id)]
+        self._changed(item_id)
+
+    def flush(self):
+        if self.state['owner'] is None or not self.state['changed']:
+            return
+
+        changed = [int(item_id) for item_id in self.state['changed']]
+        quantities = {item_id: quantity
+                      for item_id, quantity in self.quantities().items()
+                      if item_id in changed}
+        # Items deleted since they were added to the cart are dropped
+        existing = list(Item.objects.filter(
+            pk__in=list(quantities)).values_list('pk', flat=True))
+        lines = CartDetails.objects.filter(user=self.user)
+
+        with transaction.atomic():
+            lines.filter(item_id__in=changed).exclude(
+                item_id__in=existing).delete()
+            stored = dict(lines.filter(item_id__in=existing).values_list(
+                'item_id', 'cart_detail_id'))
+            for item_id in stored:
+                lines.filter(pk=stored[item_id]).update(
+                    quantity=quantities[item_id])
+            CartDetails.objects.bulk_create([
+                CartDetails(user=self.user, item_id=item_id,
+                            quantity=quantities[item_id])
+                for item_id in existing if item_id not in stored
+            ])
+
+        self.state['changed'] = []
+        self.state['flushed'] = time.time()
+        self._save()
+
+    def clear(self):
+        self.state['lines'] = {}
+        self.state['changed'] = []
+        self._save()
+
+
+"""
+Returns the cart of the user making the request
+"""
+
+
+def get_cart(request):
+    if not request.user.is_authenticated:
+        return SessionCart(request)
+    storage = getattr(settings, 'CART_STORAGE', 'pages.cart.SessionCart')
+    return import_string(storage)(request)
+
+
+"""
+Moves the cart a user filled in anonymously into their own cart at login
+"""
+
+
+def merge_anonymous_cart(request):
+    state = request.session.get(SESSION_KEY)
+    if state is None or state['owner'] is not None:
+        return
+    del request.session[SESSION_KEY]
+
+    cart = get_cart(request)
+    for item_id, quantity in state['lines'].items():
+        cart.add(int(item_id), quantity)
+    cart.flush()
@@ -0,0 +1,172 @@
+import base64
+import json
+
+from django.db.models import F, Q
+
+'''
+Query engine for the catalogue on the home page.
+
+Only whitelisted sorts and filters are exposed and every one of them is
+backed by an index on Item (see Item.Meta.indexes). Pages are fetched with
+keyset (cursor) pagination: a range condition on the sort column and the
+item_id tiebreak instead of an OFFSET, so page 500 costs the same as page 1.
+'''
+
+PAGE_SIZE = 24  # Number of items per catalogue page
+
+# Supported sorts mapped to the column they order by. Each column has a
+# composite (column, item_id) index, plus a partial one for in-stock items.
+SORTS = {
+    'name': 'name',
+    '-name': 'name',
+    'price': 'price',
+    '-price': 'price',
+    'rating': 'rating_average',
+    '-rating': 'rating_average',
+}
+
+DEFAULT_SORT = 'name'
+
+
+# Upper bound for name prefix ranges, sorts after any other character
+PREFIX_END = '\U0010ffff'
+
+# Condition for an item with available stock, shared with the partial indexes
+IN_STOCK = Q(quantity_stock__gt=F('quantity_order'))
+
+
+"""
+Raised when a cursor from the query string cannot be decoded
+"""
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+"""
+A single page of the catalogue together with the cursors of its neighbours.
+"""
+
+
+class CataloguePage:
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+"""
+Applies the catalogue filters to a queryset of items. The name prefix is
+turned into a range so that it can be answered from the name index.
+"""
+
+
+def filter_items(queryset, min_price=None, max_price=None, in_stock=False,
+                 prefix=''):
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+    if in_stock:
+        queryset = queryset.filter(IN_STOCK)
+    if prefix:
+        queryset = queryset.filter(name__gte=prefix,
+                                   name__lt=prefix + PREFIX_END)
+    return queryset
+
+
+"""
+Encodes the position of an item in the given sort as an opaque string
+"""
+
+
+def encode_cursor(item, sort):
+    value = getattr(item, SORTS[sort])
+    payload = json.dumps([str(value), item.item_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+"""
+Decodes a cursor back into the (sort value, item_id) pair it was made from
+"""
+
+
+def decode_cursor(cursor):
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(value, str) or not isinstance(item_id, int):
+        raise InvalidCursor(cursor)
+    return value, item_id
+
+
+"""
+Returns the Q object selecting the rows that come after the cursor position
+in an ascending (or descending) walk of the index.
+"""
+
+
+def _beyond(field, value, item_id, descending):
+    op = 'lt' if descending else 'gt'
+    return (Q(**{f'{field}__{op}': value}) |
+            Q(**{field: value, f'item_id__{op}': item_id}))
+
+
+"""
+Returns the page of the queryset in the given sort that comes after the
+`after` cursor, or before the `before` cursor, or the first page.
+"""
+
+
+def paginate(queryset, sort=DEFAULT_SORT, after=None, before=None,
+             page_size=PAGE_SIZE):
+    field = SORTS[sort]
+    descending = sort.startswith('-')
+
+    # Walking backwards from `before` is a forward walk in the reverse order
+    backwards = before is not None
+    if backwards ^ descending:
+        ordering = ['-' + field, '-item_id']
+    else:
+        ordering = [field, 'item_id']
+
+    cursor = before if backwards else after
+    if cursor is not None:
+        value, item_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            _beyond(field, value, item_id, ordering[0].startswith('-')))
+
+    # Fetch one extra row to learn whether there is another page
+    items = list(queryset.order_by(*ordering)[:page_size + 1])
+    more = len(items) > page_size
+    items = items[:page_size]
+
+    if backwards:
+        items.reverse()
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, cursor is not None
+
+    if not items:
+        return CataloguePage(items)
+
+    return CataloguePage(
+        items,
+        next_cursor=encode_cursor(items[-1], sort) if has_next else None,
+        prev_cursor=encode_cursor(items[0], sort) if has_previous else None,
+    )
@@ -0,0 +1,75 @@
+from collections import Counter
+
+from .models import CartDetails, Order, OrderDetails
+from .stock import reserve_stock, run_with_retry
+from .tasks import enqueue, reconcile_inventory, send_order_confirmation
+
+'''
+Checkout pipeline turning a user's cart into an order. Everything happens
+in one transaction with a fixed number of queries at any cart size.
+'''
+
+
+"""
+Raised when a user checks out without anything in the cart
+"""
+
+
+class EmptyCart(Exception):
+    pass
+
+
+"""
+Creates the order and its lines, reserves the stock, clears the cart and
+queues the confirmation. Runs inside the transaction opened by place_order.
+"""
+
+
+def _place_order(user, profile):
+    cart, total = CartDetails.objects.filter(user=user).summary()
+    if not cart:
+        raise EmptyCart()
+
+    # The total and line count are stored so order lists never sum lines
+    order = Order.objects.create(
+        user=profile, total=total, line_count=len(cart))
+
+    lines = []
+    for cart_item in cart:
+        # The price and name are snapshotted for the order history
+        line = OrderDetails(order_id=order, item=cart_item.item,
+                            quantity=cart_item.quantity,
+                            unit_price=cart_item.item.price,
+                            item_name=cart_item.item.name)
+        line.subtotal = cart_item.subtotal
+        lines.append(line)
+    OrderDetails.objects.bulk_create(lines)
+
+    # Reserve the stock of every item, raises OutOfStock on a shortfall
+    quantities = Counter()
+    for line in lines:
+        quantities[line.item_id] += line.quantity
+    reserve_stock(quantities)
+
+    CartDetails.objects.filter(user=user).delete()
+
+    # Side effects run after the commit, off the request
+    enqueue(send_order_confirmation, order.order_id,
+            key=f'order-confirmation:{order.order_id}')
+    enqueue(reconcile_inventory, order.order_id,
+            key=f'reconcile-inventory:{order.order_id}')
+
+    order.lines = lines
+    return order
+
+
+"""
+Places an order for everything in the user's cart: creates the order and
+its lines, reserves the stock of the items and clears the cart. Returns the
+order with a `total` and its `lines`, each line carrying a `subtotal`.
+Raises EmptyCart or OutOfStock, in which case nothing is written.
+"""
+
+
+def place_order(user):
+    return run_with_retry(_place_order, user, user.profile)
@@ -0,0 +1,64 @@
+import calendar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+""" 
+login_required for async views. Django's decorator is sync only, and
+request.user has to be loaded off the event loop since it queries the
+session and the user.
+"""
+
+
+def async_login_required(login_url=None):
+    def decorator(view):
+        @wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            is_authenticated = await sync_to_async(
+                lambda: request.user.is_authenticated)()
+            if not is_authenticated:
+                return redirect_to_login(request.get_full_path(), login_url)
+            return await view(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+""" 
+Conditional GET for async views, like Django's sync only condition
+decorator. validators(request, *args, **kwargs) returns the ETag and the
+last modification time of the page; it runs off the event loop and a request
+matching them gets a 304 before the view runs. Responses are marked
+no-cache so that browsers and proxies revalidate them every time.
+"""
+
+
+def async_condition(validators):
+    def decorator(view):
+        @wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+
+            etag, modified = await sync_to_async(validators)(
+                request, *args, **kwargs)
+            last_modified = (calendar.timegm(modified.utctimetuple())
+                             if modified else None)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+            response = await view(request, *args, **kwargs)
+            if response.status_code == 200:
+                if etag:
+                    response.setdefault('ETag', etag)
+                if last_modified:
+                    response.setdefault('Last-Modified',
+                                        http_date(last_modified))
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,155 @@
+import csv
+import json
+import tempfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, DecimalField, F, Max, Sum
+
+from .models import DecimalExpression, Order, OrderDetails
+
+'''
+Streaming exports for reporting. Rows are read with iterator() in chunks
+and written as they come, so memory stays flat at any table size and the
+first bytes are sent right away. Every export comes as CSV or JSON Lines.
+Under ASGI, Django 3.1 iterates a streaming body on the event loop, where
+the queries are not allowed, so there the export is written to a temporary
+file first and the file is streamed instead.
+'''
+
+CHUNK_SIZE = 2000  # Rows fetched from the database at a time
+
+# Columns of the orders export
+ORDER_COLUMNS = [
+    ('order', 'order_id'),
+    ('username', 'user__user__username'),
+    ('created', 'created_date'),
+    ('status', 'status'),
+    ('total', 'total'),
+    ('line_count', 'line_count'),
+]
+
+# Columns of the order lines export, read from the snapshots on the lines
+ORDER_LINE_COLUMNS = [
+    ('order_line', 'order_detail_id'),
+    ('order', 'order_id'),
+    ('created', 'order_id__created_date'),
+    ('status', 'order_id__status'),
+    ('item', 'item_id'),
+    ('item_name', 'item_name'),
+    ('unit_price', 'unit_price'),
+    ('quantity', 'quantity'),
+]
+
+ITEM_SALES_COLUMNS = ['item', 'item_name', 'orders', 'units', 'revenue']
+
+
+"""
+File-like object returning what is written to it, for csv.writer
+"""
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+"""
+Yields the header and every row as a line of CSV
+"""
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+"""
+Yields every row as a JSON object on its own line
+"""
+
+
+def jsonl_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+# Output formats: (line writer, content type)
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+"""
+Returns the rows of every order, oldest first
+"""
+
+
+def order_rows(chunk_size=CHUNK_SIZE):
+    return Order.objects.order_by('order_id').values_list(
+        *[field for _, field in ORDER_COLUMNS]).iterator(chunk_size)
+
+
+"""
+Returns the rows of every order line, oldest first. Never joins Item.
+"""
+
+
+def order_line_rows(chunk_size=CHUNK_SIZE):
+    return OrderDetails.objects.order_by('order_detail_id').values_list(
+        *[field for _, field in ORDER_LINE_COLUMNS]).iterator(chunk_size)
+
+
+"""
+Returns the number of orders, units sold and revenue of every item sold,
+aggregated by the database from the order line snapshots
+"""
+
+
+def item_sales_rows(chunk_size=CHUNK_SIZE):
+    sales = OrderDetails.objects.values('item_id').annotate(
+        name=Max('item_name'),
+        orders=Count('order_id', distinct=True),
+        units=Sum('quantity'),
+        revenue=DecimalExpression(
+            Sum(F('unit_price') * F('quantity'), output_field=DecimalField()),
+            output_field=DecimalField(max_digits=12, decimal_places=2)),
+    ).order_by('item_id').values_list(
+        'item_id', 'name', 'orders', 'units', 'revenue')
+    return sales.iterator(chunk_size)
+
+
+# Exports by name: (header, rows)
+EXPORTS = {
+    'orders': ([column for column, _ in ORDER_COLUMNS], order_rows),
+    'order-lines': ([column for column, _ in ORDER_LINE_COLUMNS],
+                    order_line_rows),
+    'item-sales': (ITEM_SALES_COLUMNS, item_sales_rows),
+}
+
+
+"""
+Yields the lines of an export in the given format
+"""
+
+
+def export_lines(name, format, chunk_size=CHUNK_SIZE):
+    header, rows = EXPORTS[name]
+    writer, _ = FORMATS[format]
+    return writer(header, rows(chunk_size))
+
+
+"""
+Writes the lines of an export to a temporary file and returns it, rewound
+"""
+
+
+def export_file(name, format, chunk_size=CHUNK_SIZE):
+    file = tempfile.TemporaryFile()
+    for line in export_lines(name, format, chunk_size):
+        file.write(line.encode())
+    file.seek(0)
+    return file
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePath
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from PIL import Image
+
+'''
+Image derivatives of the item pictures. Every picture is resized to the
+widths of each size in WebP and JPEG. The files are named after a hash of
+the picture so they can be cached forever, and the hash is stored on the
+item (Item.picture_hash) once all of them are written.
+'''
+
+logger = logging.getLogger(__name__)
+
+IMAGE_URL = '/static/items/'  # URL the item pictures are served from
+DERIVED_DIR = 'derived'  # Folder of the derivatives inside the picture root
+
+# Named sizes and the widths generated for each (1x and 2x screens)
+SIZES = {
+    'grid': (320, 640),
+    'detail': (640, 1280),
+}
+
+# File extension and Pillow format of every derivative
+FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+QUALITY = 80
+
+# Workers generating derivatives in the background
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='images')
+
+
+"""
+Returns the folder holding the item pictures
+"""
+
+
+def image_root():
+    return getattr(settings, 'ITEM_IMAGE_ROOT',
+                   settings.BASE_DIR / 'static' / 'items')
+
+
+"""
+Returns the content hash of a picture file
+"""
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as picture:
+        for chunk in iter(lambda: picture.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+"""
+Returns the path of a derivative relative to the picture root
+"""
+
+
+def derivative_name(picture, picture_hash, width, extension):
+    stem = PurePath(str(picture)).stem
+    return f'{DERIVED_DIR}/{stem}-{width}w-{picture_hash}.{extension}'
+
+
+"""
+Returns the URL of a derivative
+"""
+
+
+def derivative_url(picture, picture_hash, width, extension='jpg'):
+    return IMAGE_URL + derivative_name(picture, picture_hash, width, extension)
+
+
+"""
+Returns the srcset attribute listing every width of a size
+"""
+
+
+def srcset(picture, picture_hash, size, extension='jpg'):
+    return ', '.join(
+        f'{derivative_url(picture, picture_hash, width, extension)} {width}w'
+        for width in SIZES[size])
+
+
+"""
+Writes every derivative of a picture and returns the hash they are named
+after. Files that already exist are kept since their name is their content.
+"""
+
+
+def write_derivatives(picture):
+    root = image_root()
+    source = root / str(picture)
+    picture_hash = hash_file(source)
+    os.makedirs(root / DERIVED_DIR, exist_ok=True)
+
+    with Image.open(source) as original:
+        original.load()
+        if original.mode not in ('RGB', 'L'):
+            # Flatten transparency on white since JPEG has no alpha channel
+            background = Image.new('RGB', original.size, 'white')
+            background.paste(original, mask=original.convert('RGBA'))
+            original = background
+
+        for width in sorted({width for widths in SIZES.values()
+                             for width in widths}):
+            resized = original.copy()
+            resized.thumbnail((width, original.height), Image.LANCZOS)
+            for extension, image_format in FORMATS.items():
+                target = root / derivative_name(
+                    picture, picture_hash, width, extension)
+                if not target.exists():
+                    resized.save(target, image_format, quality=QUALITY)
+
+    return picture_hash
+
+
+"""
+Generates the derivatives of an item and records their hash on it
+"""
+
+
+def generate_derivatives(item_id):
+    from .cache import invalidate_item
+    from .models import Item
+
+    picture = Item.objects.filter(pk=item_id).values_list(
+        'picture', flat=True).first()
+    if not picture:
+        return None
+
+    try:
+        picture_hash = write_derivatives(picture)
+    except OSError:
+        logger.exception('Could not resize the picture of item %s', item_id)
+        return None
+
+    # Only record the hash if the picture was not replaced in the meantime
+    Item.objects.filter(pk=item_id, picture=picture).update(
+        picture_hash=picture_hash, version=F('version') + 1,
+        modified=timezone.now())
+    invalidate_item(item_id)
+    return picture_hash
+
+
+"""
+Runs generate_derivatives on a worker thread, which has its own connection
+"""
+
+
+def _generate_in_background(item_id):
+    try:
+        generate_derivatives(item_id)
+    finally:
+        connections.close_all()
+
+
+"""
+Generates the derivatives of an item in the background once the current
+transaction commits, or right away if IMAGE_DERIVATIVES_ASYNC is off.
+"""
+
+
+def schedule_derivatives(item_id):
+    if not getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        generate_derivatives(item_id)
+        return
+    transaction.on_commit(
+        lambda: _executor.submit(_generate_in_background, item_id))
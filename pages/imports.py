@@ -0,0 +1,210 @@
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from myapp.forms import ItemImportForm
+from .cache import invalidate_items
+from .images import schedule_derivatives
+from .models import Item
+from .search import get_backend
+
+'''
+Bulk import of the catalogue. Rows are read one at a time from a CSV or
+JSON Lines file, validated with the fields of ItemImportForm and upserted
+by name in batches: one query finds the existing items of a batch, which
+are updated with one parametrized UPDATE run through executemany, and the
+new ones are inserted with bulk_create, each batch in its own transaction.
+bulk_update is not used since Django 3.1 builds a CASE per row and field,
+which costs more than the writes themselves. The Item signals
+do not fire for bulk writes, so the search index, the cached item pages and
+the picture derivatives are brought up to date once per batch instead.
+'''
+
+BATCH_SIZE = 1000  # Rows written per transaction
+
+# Columns of the file mapped to the Item fields they set. A column missing
+# from a row leaves the field of an existing item as it is.
+COLUMNS = {
+    'name': 'name',
+    'price': 'price',
+    'description': 'description',
+    'stock': 'quantity_stock',
+    'picture': 'picture',
+}
+
+
+"""
+Yields the rows of a CSV file with a header line
+"""
+
+
+def csv_rows(lines):
+    yield from csv.DictReader(lines)
+
+
+"""
+Yields the rows of a JSON Lines file, one object per line
+"""
+
+
+def jsonl_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        # Anything but an object fails validation like a bad CSV row would
+        yield row if isinstance(row, dict) else {}
+
+
+FORMATS = {
+    'csv': csv_rows,
+    'jsonl': jsonl_rows,
+}
+
+
+"""
+Counts of an import, updated after every batch
+"""
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # (row number, message) of the rejected rows
+        self.rows = 0
+
+    def __str__(self):
+        return (f'{self.rows} rows: {self.created} created, '
+                f'{self.updated} updated, {len(self.errors)} rejected')
+
+
+"""
+Returns the Item field values of a row, or raises ValueError with the
+reasons it was rejected
+"""
+
+
+def clean_row(row):
+    # The fields are used without building a form, which would deep copy
+    # all of them for every row
+    values, errors = {}, []
+    for column, field in ItemImportForm.base_fields.items():
+        try:
+            value = field.clean(row.get(column))
+        except ValidationError as error:
+            errors.append(f'{column}: {" ".join(error.messages)}')
+            continue
+        if column in row and value is not None:
+            values[COLUMNS[column]] = value
+    if errors:
+        raise ValueError('; '.join(errors))
+    return values
+
+
+"""
+Writes the given fields of existing items with one UPDATE statement run
+for every item
+"""
+
+
+def update_items(items, fields):
+    quote = connection.ops.quote_name
+    fields = [Item._meta.get_field(field) for field in fields]
+    sql = (f'UPDATE {quote(Item._meta.db_table)} SET '
+           + ', '.join(f'{quote(field.column)} = %s' for field in fields)
+           + f' WHERE {quote(Item._meta.pk.column)} = %s')
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(item, field.attname), connection)
+             for field in fields] + [item.pk]
+            for item in items])
+
+
+"""
+Writes one batch of {name: field values} and refreshes what the Item
+signals would have: the search index, the cached pages of the updated
+items and the derivatives of new pictures
+"""
+
+
+def write_batch(batch, report):
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {}
+        for item in Item.objects.filter(name__in=list(batch)).only(
+                'item_id', 'name', 'picture', 'version').order_by('item_id'):
+            existing.setdefault(item.name, item)
+
+        # Rows with the same columns are updated together
+        updates = {}
+        for name, item in existing.items():
+            values = batch[name]
+            if str(values.get('picture', item.picture) or '') != str(
+                    item.picture or ''):
+                values['picture_hash'] = ''
+            for field, value in values.items():
+                setattr(item, field, value)
+            item.version += 1
+            item.modified = now
+            fields = tuple(sorted(field for field in values if field != 'name'))
+            updates.setdefault(fields, []).append(item)
+        for fields, items in updates.items():
+            update_items(items, [*fields, 'version', 'modified'])
+
+        Item.objects.bulk_create([
+            Item(version=1, **values)
+            for name, values in batch.items() if name not in existing])
+
+        # SQLite does not return the keys of bulk inserts, so read them back
+        items = list(Item.objects.filter(name__in=list(batch)).only(
+            'item_id', 'name', 'description', 'picture', 'picture_hash'))
+        get_backend().index_items(items)
+        for item in items:
+            if item.picture and not item.picture_hash:
+                schedule_derivatives(item.item_id)
+
+    invalidate_items(item.item_id for item in existing.values())
+    report.updated += len(existing)
+    report.created += len(batch) - len(existing)
+
+
+"""
+Imports the rows and returns an ImportReport. Invalid rows are skipped
+and reported, a name repeated within a batch keeps its last row. progress
+is called with the report after every batch.
+"""
+
+
+def import_items(rows, batch_size=BATCH_SIZE, progress=None):
+    report = ImportReport()
+    batch = {}
+
+    for number, row in enumerate(rows, 1):
+        report.rows = number
+        try:
+            values = clean_row(row)
+        except ValueError as error:
+            report.errors.append((number, str(error)))
+            continue
+
+        batch.pop(values['name'], None)
+        batch[values['name']] = values
+        if len(batch) >= batch_size:
+            write_batch(batch, report)
+            batch = {}
+            if progress is not None:
+                progress(report)
+
+    if batch:
+        write_batch(batch, report)
+        if progress is not None:
+            progress(report)
+    return report
@@ -0,0 +1,51 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+
+from pages.models import Order, OrderDetails
+
+""" 
+Recomputes the total and line count of every order from the price
+snapshots of its lines, in case they ever drift. Existing orders were
+filled by the 0007 migration. The sums are streamed and written back in
+batches, each in its own transaction.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Backfills the total and line count of every order.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of orders updated per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # One grouped query for the total and line count of every order
+        summaries = OrderDetails.objects.values('order_id').annotate(
+            total=Sum(F('unit_price') * F('quantity'),
+                      output_field=DecimalField()),
+            count=Count('order_detail_id')).order_by(
+            'order_id').iterator(batch_size)
+
+        # Orders without lines are reset, the others are overwritten
+        Order.objects.filter(orderdetails__isnull=True).update(
+            total=0, line_count=0)
+
+        updated = 0
+        while True:
+            orders = [Order(order_id=summary['order_id'],
+                            total=summary['total'],
+                            line_count=summary['count'])
+                      for summary in islice(summaries, batch_size)]
+            if not orders:
+                break
+            with transaction.atomic():
+                Order.objects.bulk_update(orders, ['total', 'line_count'])
+            updated += len(orders)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled the totals of {updated} orders.'))
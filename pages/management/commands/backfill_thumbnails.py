@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from pages.images import generate_derivatives
+from pages.models import Item
+
+""" 
+Generates the resized copies of item pictures that do not have them yet,
+for example pictures added before the image pipeline existed.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized copies of the item pictures.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate the copies of every picture.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of pictures resized in parallel.')
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(picture='').exclude(picture__isnull=True)
+        if not options['all']:
+            items = items.filter(picture_hash='')
+        item_ids = list(items.values_list('item_id', flat=True))
+
+        def generate(item_id):
+            try:
+                return generate_derivatives(item_id)
+            finally:
+                connections.close_all()  # worker threads own a connection
+
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            if options['workers'] > 1:
+                results = pool.map(generate, item_ids)
+            else:
+                results = map(generate_derivatives, item_ids)
+
+            for item_id, picture_hash in zip(item_ids, results):
+                if picture_hash is None:
+                    failed += 1
+                    self.stderr.write(f'Item {item_id}: could not resize')
+                else:
+                    done += 1
+                self.stdout.write(f'{done + failed}/{len(item_ids)}',
+                                  ending='\r')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Resized {done} pictures, {failed} failed.'))
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pages import bench
+
+""" 
+Compares the read pages served by the threaded WSGI server against the
+async views served by uvicorn over ASGI, at high concurrency, on a
+throwaway database filled with a synthetic shop.
+"""
+
+READ_ROUTES = ['index', 'item_view', 'orders_view', 'profile_view']
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the read pages under WSGI and ASGI.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests timed per route and server.')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='Simultaneous HTTP clients.')
+        parser.add_argument('--routes', nargs='+', choices=READ_ROUTES,
+                            default=READ_ROUTES)
+        parser.add_argument('--output', help='File to write the report to.')
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise CommandError('The ASGI benchmark needs uvicorn installed.')
+
+        servers = {'wsgi': bench.live_server, 'asgi': bench.asgi_server}
+        results = {'concurrency': options['concurrency']}
+
+        with bench.test_database():
+            user_ids, item_ids = bench.seed_shop(
+                users=options['users'], items=options['items'],
+                reviews=options['items'], orders=options['orders'])
+            cookies = bench.session_cookies(bench.logged_in_clients(
+                user_ids[:options['concurrency']]))
+
+            for name, server in servers.items():
+                results[name] = {}
+                with server() as address:
+                    for route in options['routes']:
+                        self.stderr.write(f'{name}: {route}')
+                        results[name][route] = bench.run_http(
+                            route, address, cookies, item_ids,
+                            options['requests'], options['concurrency'])
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        self.stdout.write(report)
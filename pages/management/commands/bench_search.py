@@ -0,0 +1,60 @@
+import json
+import random
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from pages import bench, search
+from pages.models import Item
+
+""" 
+Benchmarks the search backends against a naive icontains scan on a
+throwaway database filled with synthetic items.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks full text search against an icontains scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000,
+                            help='Number of synthetic items.')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Number of queries timed per approach.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        queries = [' '.join(rng.sample(bench.VOCABULARY[:38], 2))
+                   if rng.random() < 0.5 else rng.choice(bench.VOCABULARY)
+                   for _ in range(options['queries'])]
+
+        with bench.test_database():
+            self.stdout.write(f"Seeding {options['items']} items...")
+            bench.seed_items(options['items'])
+
+            backends = {'python': search.PythonBackend(
+                Path(tempfile.mkdtemp()) / 'index.pickle')}
+            if search.FTS5Backend.is_available():
+                backends['fts5'] = search.FTS5Backend()
+
+            results = {}
+            for name, backend in backends.items():
+                backend.rebuild()
+                results[name] = bench.summarize(bench.time_calls(
+                    lambda query: search.search(query, backend=backend),
+                    queries))
+
+            def naive(query):
+                condition = Q()
+                for term in search.tokenize(query):
+                    condition &= (Q(name__icontains=term) |
+                                  Q(description__icontains=term))
+                return list(Item.objects.filter(condition).order_by(
+                    'name')[:search.PAGE_SIZE])
+
+            results['icontains'] = bench.summarize(
+                bench.time_calls(naive, queries))
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,74 @@
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand
+
+from pages import bench
+
+""" 
+Benchmarks the shop's hot paths on a throwaway database filled with a
+synthetic shop, through the test client and over HTTP with concurrent
+clients. The JSON report can be saved and compared between commits.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Load tests the shop pages and reports throughput and latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests timed per route and client.')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Simultaneous HTTP clients.')
+        parser.add_argument('--routes', nargs='+', choices=bench.ROUTES,
+                            default=list(bench.ROUTES))
+        parser.add_argument('--output', help='File to write the report to.')
+
+    def handle(self, *args, **options):
+        scale = {name: options[name]
+                 for name in ('users', 'items', 'reviews', 'orders')}
+        results = {'commit': self.commit(), 'scale': scale,
+                   'concurrency': options['concurrency'],
+                   'client': {}, 'http': {}}
+
+        with bench.test_database():
+            self.stderr.write(f'Seeding {scale}...')
+            user_ids, item_ids = bench.seed_shop(**scale)
+            clients = bench.logged_in_clients(
+                user_ids[:max(options['concurrency'], 1)])
+
+            for route in options['routes']:
+                self.stderr.write(f'Test client: {route}')
+                results['client'][route] = bench.run_client(
+                    route, clients, item_ids, options['requests'])
+
+            with bench.live_server() as address:
+                cookies = bench.session_cookies(clients)
+                for route in options['routes']:
+                    self.stderr.write(f'HTTP: {route}')
+                    results['http'][route] = bench.run_http(
+                        route, address, cookies, item_ids,
+                        options['requests'], options['concurrency'])
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        self.stdout.write(report)
+
+    """
+    Returns the commit being benchmarked, if this is a git checkout
+    """
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from pages import bench
+from pages.models import Item
+
+""" 
+Measures how many orders per second can reserve stock of the same item
+under contention, on a throwaway database. Refused attempts are the ones
+that found the stock sold out.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks concurrent stock reservations of a single item.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=2000,
+                            help='Reservations attempted in total.')
+        parser.add_argument('--stock', type=int, default=1500,
+                            help='Units of the item, below --attempts to '
+                                 'include sold out attempts.')
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        with bench.test_database():
+            bench.seed_items(1, stock=options['stock'])
+            item_id = Item.objects.get().item_id
+            result = bench.run_reservations(
+                item_id, options['attempts'], options['threads'])
+
+            item = Item.objects.get()
+            result['oversold'] = max(
+                0, item.quantity_order - item.quantity_stock)
+
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from pages import bench
+
+""" 
+Measures the share of the server time of the storefront pages spent
+rendering templates, before (templates parsed on every request, no fragment
+cache) and after (cached loader and cached item fragments), on a throwaway
+database filled with a synthetic shop.
+"""
+
+RENDER_ROUTES = ['index', 'item_view']
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks template rendering with and without caching.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--reviews', type=int, default=5000)
+        parser.add_argument('--hot-items', type=int, default=24,
+                            help='Items the item pages are requested for.')
+        parser.add_argument('--requests', type=int, default=300,
+                            help='Requests timed per route and setup.')
+        parser.add_argument('--routes', nargs='+', choices=RENDER_ROUTES,
+                            default=RENDER_ROUTES)
+        parser.add_argument('--output', help='File to write the report to.')
+
+    def handle(self, *args, **options):
+        results = {}
+
+        with bench.test_database():
+            _, item_ids = bench.seed_shop(
+                users=20, items=options['items'],
+                reviews=options['reviews'], orders=0)
+            hot_ids = item_ids[:options['hot_items']]
+
+            for name, cached in (('before', False), ('after', True)):
+                results[name] = {}
+                with bench.render_settings(cached):
+                    for route in options['routes']:
+                        self.stderr.write(f'{name}: {route}')
+                        results[name][route] = bench.run_render(
+                            route, hot_ids, options['requests'])
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        self.stdout.write(report)
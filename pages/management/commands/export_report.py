@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from pages import exports
+
+""" 
+Writes orders, order lines or item sales as CSV or JSON Lines to a file or
+to stdout, streaming the rows in chunks.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Exports orders, order lines or item sales for reporting.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=exports.EXPORTS)
+        parser.add_argument('--format', choices=exports.FORMATS,
+                            default='csv')
+        parser.add_argument('--output', help='File to write, stdout if unset.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=exports.CHUNK_SIZE,
+                            help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        lines = exports.export_lines(options['name'], options['format'],
+                                     options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                count = self.write(output, lines)
+            self.stderr.write(self.style.SUCCESS(
+                f"Wrote {count} lines to {options['output']}."))
+        else:
+            self.write(self.stdout, lines)
+
+    @staticmethod
+    def write(output, lines):
+        count = 0
+        for line in lines:
+            output.write(line)
+            count += 1
+        return count
@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pages import imports
+
+""" 
+Creates or updates items from a CSV or JSON Lines file with the columns
+name, price, description, stock and picture. Items are matched by name and
+written in batches, reporting progress after each one.
+"""
+
+MAX_ERRORS_SHOWN = 20  # Rejected rows listed at the end of the import
+
+
+class Command(BaseCommand):
+    help = 'Imports or updates items from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=imports.FORMATS,
+                            help='Format of the file, from its extension '
+                                 'if unset.')
+        parser.add_argument('--batch-size', type=int,
+                            default=imports.BATCH_SIZE,
+                            help='Rows written per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1][1:].lower()
+        if format not in imports.FORMATS:
+            raise CommandError(
+                f'Unknown format {format!r}, use --format csv or jsonl.')
+
+        started = time.perf_counter()
+
+        def progress(report):
+            self.stderr.write(
+                f'{report} ({time.perf_counter() - started:.1f}s)')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as lines:
+                report = imports.import_items(
+                    imports.FORMATS[format](lines), options['batch_size'],
+                    progress)
+        except OSError as error:
+            raise CommandError(f'Could not read {path}: {error}')
+
+        for number, message in report.errors[:MAX_ERRORS_SHOWN]:
+            self.stderr.write(self.style.WARNING(f'Row {number}: {message}'))
+        if len(report.errors) > MAX_ERRORS_SHOWN:
+            self.stderr.write(self.style.WARNING(
+                f'... and {len(report.errors) - MAX_ERRORS_SHOWN} more.'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report} in {time.perf_counter() - started:.1f}s.'))
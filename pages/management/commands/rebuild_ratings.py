@@ -0,0 +1,60 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from pages.cache import invalidate_items
+from pages.models import Item, Review
+
+""" 
+Rebuilds the rating summary of every item from its reviews in bulk.
+Use it after importing reviews or if the summaries ever drift.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the review count and rating average of every item.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of items updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # One grouped query for the count and sum of every reviewed item
+        summaries = Review.objects.values('item').annotate(
+            count=Count('review_id'), total=Sum('rating')).order_by()
+
+        items = []
+        for summary in summaries.iterator():
+            item = Item(item_id=summary['item'],
+                        review_count=summary['count'],
+                        rating_total=summary['total'])
+            item.rating_average = item.rating_total / item.review_count
+            items.append(item)
+
+        with transaction.atomic():
+            # Items without reviews are reset, the others are overwritten
+            Item.objects.filter(review__isnull=True).update(
+                review_count=0, rating_total=0, rating_average=0)
+            Item.objects.bulk_update(
+                items, ['review_count', 'rating_total', 'rating_average'],
+                batch_size=batch_size)
+            # Every item card shows the rating, render them all again
+            Item.objects.update(version=F('version') + 1,
+                                modified=timezone.now())
+
+        # The bulk updates skip the signals, drop the cached item pages
+        item_ids = Item.objects.values_list('item_id', flat=True).iterator(
+            batch_size)
+        while True:
+            batch = list(islice(item_ids, batch_size))
+            if not batch:
+                break
+            invalidate_items(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the ratings of {len(items)} reviewed items.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from pages.search import get_backend
+
+""" 
+Rebuilds the search index from the items, for example after a bulk import
+that bypassed the Item signals.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full text search index of the items.'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the {type(backend).__name__} search index.'))
@@ -0,0 +1,61 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from pages import tasks
+
+""" 
+Runs the queued jobs of the task queue until interrupted. Several of these
+commands may run at once, every job is still run by only one of them.
+"""
+
+
+class Command(BaseCommand):
+    help = 'Runs the jobs of the task queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Jobs run at the same time.')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds between looks for due jobs.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the due jobs and exit.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        if not options['once']:
+            signal.signal(signal.SIGTERM, lambda *args: stop.set())
+            signal.signal(signal.SIGINT, lambda *args: stop.set())
+
+        def run(job_id):
+            try:
+                tasks.run_job(job_id)
+            finally:
+                connections.close_all()
+
+        # A single thread runs the jobs inline, on this connection
+        executor = None
+        if options['threads'] > 1:
+            executor = ThreadPoolExecutor(options['threads'])
+
+        done = 0
+        while not stop.is_set():
+            tasks.release_expired()
+            job_ids = tasks.due_jobs(max(options['threads'], 1) * 4)
+            if executor is None:
+                for job_id in job_ids:
+                    tasks.run_job(job_id)
+            else:
+                list(executor.map(run, job_ids))
+            done += len(job_ids)
+            if options['once'] and not job_ids:
+                break
+            if not job_ids:
+                stop.wait(options['poll'])
+
+        if executor is not None:
+            executor.shutdown()
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs.'))
@@ -0,0 +1,159 @@
+import asyncio
+import mimetypes
+import os
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from . import images, staticfiles, stats
+
+""" 
+Records the number of queries, database time, template time and total
+latency of every request, sends them in a Server-Timing header and adds
+them to the rolling histogram of the request's URL name. Works in front of
+both sync and async views without switching threads.
+"""
+
+
+class RequestStatsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        request_stats = stats.RequestStats()
+        token = stats.start(request_stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats.finish(token)
+        return self.finish(request, response, request_stats,
+                           time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        request_stats = stats.RequestStats()
+        token = stats.start(request_stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stats.finish(token)
+        return self.finish(request, response, request_stats,
+                           time.perf_counter() - started)
+
+    def finish(self, request, response, request_stats, total):
+        response['Server-Timing'] = request_stats.server_timing(total)
+        stats.histogram.record(url_name(request), request_stats, total)
+        return response
+
+
+""" 
+Returns the name of the URL pattern that handled the request
+"""
+
+
+def url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.url_name or match.view_name
+
+
+""" 
+Serves the collected static files (and the item pictures) in production.
+Hashed names are cached by browsers and CDNs for a year without
+revalidation, and the .br/.gz variants written by collectstatic are sent
+to clients that accept them. runserver serves static files before this.
+"""
+
+
+class StaticAssetMiddleware(MiddlewareMixin):
+
+    IMMUTABLE = 'public, max-age=31536000, immutable'
+    REVALIDATE = 'public, max-age=60'
+
+    # Accept-Encoding token and file suffix, preferred first
+    ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.prefix = urlsplit(settings.STATIC_URL).path
+        # URL prefixes and the folders they are served from, most specific
+        # first. The item pictures and their derivatives are not collected.
+        self.roots = [(self.prefix + 'items/', images.image_root())]
+        if settings.STATIC_ROOT:
+            self.roots.append((self.prefix, settings.STATIC_ROOT))
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        path = self.find(request.path)
+        if path is None:
+            return None
+
+        modified = os.path.getmtime(path)
+        if not was_modified_since(
+                request.META.get('HTTP_IF_MODIFIED_SINCE'), modified):
+            response = HttpResponseNotModified()
+        else:
+            content_type = (mimetypes.guess_type(path)[0] or
+                            'application/octet-stream')
+            encoding, served = self.negotiate(request, path)
+            response = FileResponse(open(served, 'rb'),
+                                    content_type=content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+            response['Last-Modified'] = http_date(modified)
+
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = (
+            self.IMMUTABLE if staticfiles.HASHED_NAME.search(path)
+            else self.REVALIDATE)
+        return response
+
+    """
+    Returns the file a static URL points at, None if there is none
+    """
+
+    def find(self, url_path):
+        for prefix, root in self.roots:
+            if url_path.startswith(prefix):
+                try:
+                    path = safe_join(root, url_path[len(prefix):])
+                except SuspiciousFileOperation:
+                    return None
+                return path if os.path.isfile(path) else None
+        return None
+
+    """
+    Returns the encoding and the file to send, the smallest variant the
+    client accepts
+    """
+
+    def negotiate(self, request, path):
+        accepted = {
+            token.split(';')[0].strip()
+            for token in request.META.get(
+                'HTTP_ACCEPT_ENCODING', '').split(',')
+            if not token.replace(' ', '').endswith(';q=0')
+        }
+        for encoding, suffix in self.ENCODINGS:
+            if encoding in accepted and os.path.isfile(path + suffix):
+                return encoding, path + suffix
+        return None, path
@@ -0,0 +1,92 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Item',
+            fields=[
+                ('item_id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=120)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('description', models.TextField(blank=True, max_length=430)),
+                ('quantity_stock', models.IntegerField(default=1)),
+                ('quantity_order', models.IntegerField(default=0)),
+                ('picture', models.ImageField(blank=True, null=True, upload_to='')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('order_id', models.AutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(default='P', max_length=10)),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Review',
+            fields=[
+                ('review_id', models.AutoField(primary_key=True, serialize=False)),
+                ('rating', models.SmallIntegerField(default=5)),
+                ('review_text', models.TextField(blank=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pages.item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('birth_date', models.DateField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderDetails',
+            fields=[
+                ('order_detail_id', models.AutoField(primary_key=True, serialize=False)),
+                ('quantity', models.SmallIntegerField(default=1)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pages.item')),
+                ('order_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pages.order')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pages.profile'),
+        ),
+        migrations.CreateModel(
+            name='CartDetails',
+            fields=[
+                ('cart_detail_id', models.AutoField(primary_key=True, serialize=False)),
+                ('quantity', models.SmallIntegerField(default=1)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pages.item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Address',
+            fields=[
+                ('address_id', models.AutoField(primary_key=True, serialize=False)),
+                ('address_type', models.CharField(default='H', max_length=1)),
+                ('address_line_1', models.CharField(blank=True, max_length=50)),
+                ('address_line_2', models.CharField(blank=True, max_length=50)),
+                ('city', models.CharField(blank=True, max_length=10)),
+                ('country', models.CharField(blank=True, max_length=15)),
+                ('zip_code', models.CharField(blank=True, max_length=8)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pages.profile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['name', 'item_id'], name='item_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price', 'item_id'], name='item_price_idx'),
+        ),
+    ]
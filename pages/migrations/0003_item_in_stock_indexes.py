@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0002_item_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(quantity_stock__gt=django.db.models.expressions.F('quantity_order')), fields=['name', 'item_id'], name='item_stock_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(quantity_stock__gt=django.db.models.expressions.F('quantity_order')), fields=['price', 'item_id'], name='item_stock_price_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.expressions
+
+
+"""
+Fills the rating summary of the items that already have reviews
+"""
+
+
+def summarize_ratings(apps, schema_editor):
+    Item = apps.get_model('pages', 'Item')
+    Review = apps.get_model('pages', 'Review')
+    summaries = Review.objects.values('item').annotate(
+        count=Count('review_id'), total=Sum('rating')).order_by()
+    items = [Item(item_id=summary['item'], review_count=summary['count'],
+                  rating_total=summary['total'],
+                  rating_average=summary['total'] / summary['count'])
+             for summary in summaries.iterator()]
+    Item.objects.bulk_update(
+        items, ['review_count', 'rating_total', 'rating_average'],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0003_item_in_stock_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_average',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='review_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['rating_average', 'item_id'], name='item_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(quantity_stock__gt=django.db.models.expressions.F('quantity_order')), fields=['rating_average', 'item_id'], name='item_stock_rating_idx'),
+        ),
+        migrations.RunPython(summarize_ratings, migrations.RunPython.noop),
+    ]
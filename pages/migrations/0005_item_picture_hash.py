@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0004_item_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='picture_hash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0005_item_picture_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False)),
+                ('task', models.CharField(max_length=200)),
+                ('args', models.JSONField(default=list)),
+                ('key', models.CharField(blank=True, max_length=200, null=True, unique=True)),
+                ('status', models.CharField(choices=[('Q', 'Queued'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='Q', max_length=1)),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('max_attempts', models.SmallIntegerField(default=3)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_at'], name='job_due_idx'),
+        ),
+    ]
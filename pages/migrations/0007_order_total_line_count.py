@@ -0,0 +1,66 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from decimal import Decimal
+from itertools import islice
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, DecimalField, F, Sum
+
+BATCH_SIZE = 1000  # Orders updated per transaction
+
+
+"""
+Stores the total and line count of the orders placed before they were kept
+on the order, priced like the order page did at the time: at the current
+price of the items. The orders are streamed and written back in batches,
+each in its own transaction.
+"""
+
+
+def fill_totals(apps, schema_editor):
+    Order = apps.get_model('pages', 'Order')
+    orders = Order.objects.filter(orderdetails__isnull=False).annotate(
+        lines_total=Sum(F('orderdetails__item__price') *
+                        F('orderdetails__quantity'),
+                        output_field=DecimalField(max_digits=10,
+                                                  decimal_places=2)),
+        lines=Count('orderdetails')).order_by('pk').iterator(BATCH_SIZE)
+    while True:
+        batch = list(islice(orders, BATCH_SIZE))
+        if not batch:
+            break
+        for order in batch:
+            order.total = Decimal(order.lines_total).quantize(Decimal('0.01'))
+            order.line_count = order.lines
+        with transaction.atomic():
+            Order.objects.bulk_update(batch, ['total', 'line_count'])
+
+
+class Migration(migrations.Migration):
+    atomic = False  # the backfill commits batch by batch
+
+    dependencies = [
+        ('pages', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_date'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status'], name='order_status_idx'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
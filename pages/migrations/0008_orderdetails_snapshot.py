@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models, transaction
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 5000  # Order lines updated per transaction
+
+
+"""
+Snapshots the current price and name of the items on the existing order
+lines, one UPDATE and transaction per range of BATCH_SIZE keys, so the
+table is never locked for the whole backfill
+"""
+
+
+def snapshot_items(apps, schema_editor):
+    Item = apps.get_model('pages', 'Item')
+    OrderDetails = apps.get_model('pages', 'OrderDetails')
+    item = Item.objects.filter(pk=OuterRef('item_id'))
+    last = OrderDetails.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        with transaction.atomic():
+            OrderDetails.objects.filter(
+                pk__gt=start, pk__lte=start + BATCH_SIZE).update(
+                unit_price=Subquery(item.values('price')[:1]),
+                item_name=Subquery(item.values('name')[:1]))
+
+
+class Migration(migrations.Migration):
+    atomic = False  # the backfill commits batch by batch
+
+    dependencies = [
+        ('pages', '0007_order_total_line_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderdetails',
+            name='item_name',
+            field=models.CharField(blank=True, max_length=120),
+        ),
+        migrations.AddField(
+            model_name='orderdetails',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.RunPython(snapshot_items, migrations.RunPython.noop),
+    ]
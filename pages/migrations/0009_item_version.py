@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0008_orderdetails_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0009_item_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
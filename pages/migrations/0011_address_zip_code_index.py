@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0010_item_review_modified'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='address',
+            name='zip_code',
+            field=models.CharField(blank=True, db_index=True, max_length=8),
+        ),
+    ]
@@ -1,8 +1,16 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import (
+    Case, DecimalField, ExpressionWrapper, F, FloatField, Prefetch, Sum, Value,
+    When, Window)
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
+from .catalogue import IN_STOCK
+from . import images
 
 # Create your models here.
 # python manage.py graph_models -a > my_project.dot
@@ -20,19 +28,47 @@ class Profile(models.Model):
         null=True, blank=True)  # Birthday of the user
 
     """ 
-    Method to automatically create profile object when a User is created
+    Remembers the stored field values so that saving the user only saves
+    the profile when it changed
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_birth_date = instance.birth_date
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._saved_birth_date = self.birth_date
+
+    def has_changed(self):
+        return self._state.adding or self.birth_date != self._saved_birth_date
+
+    """ 
+    Method to automatically create profile object when a User is created.
+    A profile attached to the user before its first save (see
+    pages.accounts.register) is saved as it is.
     """
     @receiver(post_save, sender=User)
     def create_user_profile(sender, instance, created, **kwargs):
         if created:
-            Profile.objects.create(user=instance)
+            if Profile.user.field.remote_field.is_cached(instance):
+                instance.profile.save()
+            else:
+                Profile.objects.create(user=instance)
 
     """ 
-    Method to automatically save changes to profile if changes are made
+    Method to automatically save changes to profile if changes are made.
+    Only a profile that was loaded and changed is saved, so saving a user
+    (e.g. last_login at every login) costs no profile queries.
     """
     @receiver(post_save, sender=User)
-    def save_user_profile(sender, instance, **kwargs):
-        instance.profile.save()
+    def save_user_profile(sender, instance, created, **kwargs):
+        if created or not Profile.user.field.remote_field.is_cached(instance):
+            return
+        if instance.profile.has_changed():
+            instance.profile.save()
 
     '''
     Method to display human readable field instead of
@@ -59,7 +95,7 @@ class Address(models.Model):
     address_line_2 = models.CharField(max_length=50, blank=True)
     city = models.CharField(max_length=10, blank=True)
     country = models.CharField(max_length=15, blank=True)
-    zip_code = models.CharField(max_length=8, blank=True)
+    zip_code = models.CharField(max_length=8, blank=True, db_index=True)
 
     '''
     Method to display human readable field instead of
@@ -94,6 +130,82 @@ class Address(models.Model):
             self.address_type = 'A'
 
 
+""" 
+Rounds the values of a computed decimal to the places of its output field.
+SQLite hands computed decimals back as floats, which Django only rounds for
+columns, so a sum of prices would read 33704.6100000000.
+"""
+
+
+class RoundedDecimal:
+
+    def get_db_converters(self, connection):
+        places = Decimal(1).scaleb(-self.output_field.decimal_places)
+
+        def round_places(value, expression, connection):
+            return value if value is None else value.quantize(places)
+
+        return super().get_db_converters(connection) + [round_places]
+
+
+""" 
+Decimal computed from columns, rounded to the places of its output field
+"""
+
+
+class DecimalExpression(RoundedDecimal, ExpressionWrapper):
+    pass
+
+
+""" 
+Window function typed as a decimal. Django 3.1 puts the CAST it adds to
+decimal expressions on SQLite inside the OVER (), which SQLite rejects, so
+there the window is computed as a float and cast as a whole.
+"""
+
+
+class DecimalWindow(RoundedDecimal, Window):
+
+    def as_sqlite(self, compiler, connection):
+        copy = self.copy()
+        copy.source_expression = copy.source_expression.copy()
+        copy.source_expression.output_field = FloatField()
+        sql, params = copy.as_sql(compiler, connection)
+        return f'CAST({sql} AS NUMERIC)', params
+
+
+""" 
+QuerySet for cart lines
+"""
+
+
+class CartDetailsQuerySet(models.QuerySet):
+
+    """ 
+    Joins the items and annotates each line with `quantity * item.price`
+    as `subtotal` and the sum over all lines as `total`
+    """
+
+    def with_subtotals(self):
+        subtotal = DecimalExpression(
+            F('item__price') * F('quantity'),
+            output_field=DecimalField(max_digits=10, decimal_places=2))
+        total = DecimalWindow(Sum(subtotal), output_field=DecimalField(
+            max_digits=12, decimal_places=2))
+        return self.select_related('item').annotate(
+            subtotal=subtotal, total=total).order_by('cart_detail_id')
+
+    """ 
+    Returns the lines with their subtotals and the grand total in a single
+    query, the total is 0 for an empty cart
+    """
+
+    def summary(self):
+        lines = list(self.with_subtotals())
+        total = lines[0].total if lines else 0
+        return lines, total
+
+
 """
 Model to store cart details of users. 
 """
@@ -106,8 +218,10 @@ class CartDetails(models.Model):
     item = models.ForeignKey('Item', on_delete=models.CASCADE)  # Item in Cart
     quantity = models.SmallIntegerField(default=1)  # Quantity of the Item
 
+    objects = CartDetailsQuerySet.as_manager()
+
     def __str__(self):
-        return f"{self.user.username}: {self.item.item_id}"
+        return f"{self.user.username}: {self.item_id}"
 
     def get_quantity(self):
         return self.quantity
@@ -117,6 +231,36 @@ class CartDetails(models.Model):
         return subtotal
 
 
+""" 
+QuerySet for items
+"""
+
+
+class ItemQuerySet(models.QuerySet):
+
+    """ 
+    Atomically adds `reviews` to the review count and `rating` to the rating
+    total of the items, recomputing the average in the same UPDATE so that
+    concurrent reviews never lose a write.
+    """
+
+    def adjust_rating(self, reviews, rating):
+        count = F('review_count') + reviews
+        total = F('rating_total') + rating
+        average = ExpressionWrapper(
+            Cast(total, FloatField()) / count, output_field=FloatField())
+
+        return self.update(
+            version=F('version') + 1,
+            modified=timezone.now(),
+            review_count=count,
+            rating_total=total,
+            rating_average=Case(
+                When(review_count__gt=-reviews, then=average),
+                default=Value(0.0), output_field=FloatField()),
+        )
+
+
 """ 
 Model for Items that will be sold in the website
 """
@@ -131,6 +275,39 @@ class Item(models.Model):
     quantity_stock = models.IntegerField(default=1)  # Number of Stock
     quantity_order = models.IntegerField(default=0)  # Number on Order
     picture = models.ImageField(blank=True, null=True)  # Item Picture
+    # Content hash naming the resized copies of the picture, blank until
+    # they have been generated (see pages.images)
+    picture_hash = models.CharField(max_length=12, blank=True, editable=False)
+
+    # Rating summary maintained from the reviews (see Review.save)
+    review_count = models.IntegerField(default=0)  # Number of reviews
+    rating_total = models.IntegerField(default=0)  # Sum of the ratings
+    rating_average = models.FloatField(default=0)  # Average rating
+
+    # Bumped by every change shown on the item card and page, keys their
+    # cached fragments in the templates
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # Last change of the item, also set by the queryset updates of the
+    # rating and the stock. The HTTP validators of the pages derive from it.
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ItemQuerySet.as_manager()
+
+    class Meta:
+        # Composite indexes backing the sorts and filters of the catalogue,
+        # the partial ones only hold items that are in stock
+        indexes = [
+            models.Index(fields=['name', 'item_id'], name='item_name_idx'),
+            models.Index(fields=['price', 'item_id'], name='item_price_idx'),
+            models.Index(fields=['name', 'item_id'], name='item_stock_name_idx',
+                         condition=IN_STOCK),
+            models.Index(fields=['price', 'item_id'], name='item_stock_price_idx',
+                         condition=IN_STOCK),
+            models.Index(fields=['rating_average', 'item_id'],
+                         name='item_rating_idx'),
+            models.Index(fields=['rating_average', 'item_id'],
+                         name='item_stock_rating_idx', condition=IN_STOCK),
+        ]
 
     '''
     Method to display human readable field instead of
@@ -153,11 +330,81 @@ class Item(models.Model):
             return 'Out of stock'
 
     '''
-    Returns the filepath for the item picture
+    Remembers the stored picture so that a replaced picture can be detected
+    '''
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_picture = instance.__dict__.get('picture')
+        return instance
+
+    '''
+    Forgets the resized copies when the picture is replaced and bumps the
+    version so that the cached fragments of the item are rendered again
+    '''
+
+    def save(self, *args, **kwargs):
+        saved_picture = getattr(self, '_saved_picture', None)
+        if str(self.picture or '') != str(saved_picture or ''):
+            self.picture_hash = ''
+        self.version += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = [
+                *kwargs['update_fields'], 'version', 'modified']
+        super().save(*args, **kwargs)
+        self._saved_picture = self.picture
+
+    '''
+    Returns the filepath for the item picture, or for its resized copy
+    of the given size ('grid' or 'detail') once it has been generated
+    '''
+
+    def get_image(self, size=None):
+        if size is None or not self.picture_hash:
+            return f'{images.IMAGE_URL}{self.picture}'
+        return images.derivative_url(
+            self.picture, self.picture_hash, images.SIZES[size][0])
+
+    '''
+    Returns the srcset of a size of the picture in the given format
     '''
 
-    def get_image(self):
-        return f'/static/items/{self.picture}'
+    def get_srcset(self, size, extension='jpg'):
+        if not self.picture_hash:
+            return ''
+        return images.srcset(self.picture, self.picture_hash, size, extension)
+
+
+""" 
+QuerySet for orders. Loads a user's order history together with the
+order lines and their items in a fixed number of queries.
+"""
+
+
+class OrderQuerySet(models.QuerySet):
+
+    """ 
+    Returns the orders of a profile sorted by recency, read from the
+    (user, -created_date) index. Each order carries its stored total and a
+    `lines` list of its OrderDetails, which carry a `subtotal` annotation
+    from their price snapshot. The items are only fetched for their
+    pictures and alt text, by primary key and without a join.
+    """
+
+    def history_for(self, profile):
+        subtotal = DecimalExpression(
+            F('unit_price') * F('quantity'),
+            output_field=DecimalField(max_digits=10, decimal_places=2))
+        pictures = Item.objects.only(
+            'item_id', 'name', 'picture', 'picture_hash')
+        lines = OrderDetails.objects.annotate(
+            subtotal=subtotal).prefetch_related(
+            Prefetch('item', queryset=pictures)).order_by('order_detail_id')
+
+        return self.filter(user=profile).prefetch_related(
+            Prefetch('orderdetails_set', queryset=lines, to_attr='lines')
+        ).order_by('-created_date')
 
 
 """ 
@@ -166,12 +413,29 @@ Model for user orders which serves as the FK for OrderDetails
 
 
 class Order(models.Model):
+    # Orders in these statuses hold their units in Item.quantity_order,
+    # the units of the others have left quantity_stock (see save)
+    HOLDING_STOCK = ('P',)
+
     order_id = models.AutoField(primary_key=True)  # Primary Key
     user = models.ForeignKey(
         "Profile", on_delete=models.CASCADE)  # User Foreign Key
     status = models.CharField(max_length=10, default='P')  # Order status
     created_date = models.DateTimeField(
         default=timezone.now)  # Date the order was created
+    # Stored at checkout so that order lists never sum the lines
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    line_count = models.IntegerField(default=0)  # Number of OrderDetails
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Order history of a user, newest first
+            models.Index(fields=['user', '-created_date'],
+                         name='order_user_created_idx'),
+            models.Index(fields=['status'], name='order_status_idx'),
+        ]
 
     '''
     Method to display human readable field instead of
@@ -181,6 +445,41 @@ class Order(models.Model):
     def __str__(self):
         return f"{self.user.user.username}: {str(self.created_date)[0:19]}"
 
+    """ 
+    Saves the order. A status change out of HOLDING_STOCK ships the units of
+    the order, taking them off both quantity_stock and quantity_order of the
+    items in the same transaction, and a change back returns them. The
+    stored status is read under a row lock so a change is applied once.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            stored = None
+            if not self._state.adding:
+                stored = Order.objects.select_for_update().filter(
+                    pk=self.pk).values_list('status', flat=True).first()
+            super().save(*args, **kwargs)
+            if stored is None:
+                return
+            held = stored in self.HOLDING_STOCK
+            if held != (self.status in self.HOLDING_STOCK):
+                self.move_stock(-1 if held else 1)
+
+    """ 
+    Adds sign times the units of the order to the stock and units on order
+    of its items, in item order like stock.reserve_stock
+    """
+
+    def move_stock(self, sign):
+        units = OrderDetails.objects.filter(order_id=self).values(
+            'item_id').annotate(units=Sum('quantity')).order_by(
+            'item_id').values_list('item_id', 'units')
+        for item_id, count in units:
+            Item.objects.filter(pk=item_id).update(
+                quantity_stock=F('quantity_stock') + sign * count,
+                quantity_order=F('quantity_order') + sign * count,
+                modified=timezone.now())
+
     """ 
     Method to get the status of the order
     """
@@ -208,6 +507,10 @@ class OrderDetails(models.Model):
     item = models.ForeignKey("Item", on_delete=models.CASCADE)  # Foreign Key
     # Quantity of the Item to be ordered
     quantity = models.SmallIntegerField(default=1)
+    # Price and name of the item when it was ordered, so that repricing an
+    # item never changes past orders and order history needs no Item join
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    item_name = models.CharField(max_length=120, blank=True)
 
     '''
     Method to display human readable field instead of
@@ -215,14 +518,14 @@ class OrderDetails(models.Model):
     '''
 
     def __str__(self):
-        return f"Order no. {self.order_id.order_id}:  {self.item.item_id}"
+        return f"Order no. {self.order_id_id}:  {self.item_id}"
 
     """ 
     Method to return the subtotal for the specific item/OrderDetail
     """
 
     def get_subtotal(self):
-        subtotal = self.item.price * self.quantity
+        subtotal = self.unit_price * self.quantity
         return subtotal
 
 
@@ -239,12 +542,86 @@ class Review(models.Model):
         User, on_delete=models.CASCADE)  # User making review
     rating = models.SmallIntegerField(default=5)  # Review rating
     review_text = models.TextField(blank=True)  # Text for the review
+    modified = models.DateTimeField(auto_now=True)  # Last edit of the review
+
+    """ 
+    Remembers the rating read from the database, which a delete takes out
+    of the rating summary of the item
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_rating = instance.rating
+        return instance
+
+    """ 
+    Saves the review and updates the rating summary of the item in the
+    same transaction, by the difference to the rating stored until now.
+    That rating is read under a row lock, so concurrent edits of the review
+    apply their differences one after the other. Deletes are handled by a
+    post_delete receiver.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            stored = None
+            if not self._state.adding:
+                stored = Review.objects.select_for_update().filter(
+                    pk=self.pk).values_list('rating', flat=True).first()
+            super().save(*args, **kwargs)
+            if stored is None:
+                Item.objects.filter(pk=self.item_id).adjust_rating(
+                    1, self.rating)
+            else:
+                # Also run for an unchanged rating: it bumps the version of
+                # the item, whose cached review list shows the text
+                Item.objects.filter(pk=self.item_id).adjust_rating(
+                    0, self.rating - stored)
+        self._saved_rating = self.rating
 
     """ 
     Method to update/change review details
     """
 
     def update_review(self, rating, review_text):
-        self.rating = rating
+        self.rating = int(rating)
         self.review_text = review_text
         self.save()
+
+
+""" 
+Durable background job of the task queue (see pages/tasks.py)
+"""
+
+
+class Job(models.Model):
+    QUEUED = 'Q'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'),
+                (FAILED, 'Failed')]
+
+    job_id = models.AutoField(primary_key=True)  # Primary Key
+    task = models.CharField(max_length=200)  # Import path of the task
+    args = models.JSONField(default=list)  # Arguments of the task
+    # Enqueuing the same key twice creates a single job
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(
+        max_length=1, choices=STATUSES, default=QUEUED)
+    attempts = models.SmallIntegerField(default=0)  # Runs started so far
+    max_attempts = models.SmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)  # Not run before
+    locked_until = models.DateTimeField(null=True, blank=True)  # Lease
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Workers look for due jobs of a status in run_at order
+            models.Index(fields=['status', 'run_at'], name='job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task}({self.args}): {self.get_status_display()}"
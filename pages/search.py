@@ -0,0 +1,362 @@
+import atexit
+import bisect
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Item
+
+'''
+Full text search over the name and description of the items.
+
+On SQLite builds with FTS5 the index is a virtual table kept next to the
+items. Everywhere else a pure Python inverted index is held in memory and
+persisted to SEARCH_INDEX_PATH. Both are updated from the Item signals in
+pages.signals and rank their results with BM25, matches in the name
+counting more than matches in the description.
+'''
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 24  # Number of results per page
+NAME_WEIGHT = 3.0  # Weight of the name relative to the description
+MAX_TERMS = 8  # Terms of a query that are used, the rest is ignored
+
+FTS_TABLE = 'pages_item_search'
+
+_WORD = re.compile(r'\w+')
+
+
+"""
+Splits a text into lowercase words
+"""
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+"""
+Search index backed by an SQLite FTS5 virtual table
+"""
+
+
+class FTS5Backend:
+
+    """
+    Returns True if the database is SQLite with FTS5 compiled in
+    """
+
+    @staticmethod
+    def is_available():
+        if connection.vendor != 'sqlite':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            return ('ENABLE_FTS5',) in cursor.fetchall()
+
+    """
+    Creates the table and fills it with the existing items, only the first
+    time: from then on the signals keep it in step
+    """
+
+    def create_table(self):
+        if FTS_TABLE in connection.introspection.table_names():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {FTS_TABLE} USING '
+                f"fts5(name, description, tokenize='unicode61')")
+            self._fill(cursor)
+
+    def _fill(self, cursor):
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f'SELECT item_id, name, description FROM '
+            f'{Item._meta.db_table}')
+
+    def index_item(self, item):
+        self.index_items([item])
+
+    def index_items(self, items):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                               [[item.item_id] for item in items])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                f'VALUES (%s, %s, %s)',
+                [[item.item_id, item.name, item.description]
+                 for item in items])
+
+    def remove_item(self, item_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [item_id])
+
+    def rebuild(self):
+        self.create_table()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            self._fill(cursor)
+
+    """
+    Returns the ids of the matching items for one page of results, best
+    match first, fetching one extra id to tell if there is another page
+    """
+
+    def search(self, terms, offset, limit):
+        # Every term is quoted so that user input is never FTS syntax, and
+        # the last one matches as a prefix for search-as-you-type
+        match = ' '.join(f'"{term}"' for term in terms) + '*'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, %s, 1.0), rowid '
+                f'LIMIT %s OFFSET %s',
+                [match, NAME_WEIGHT, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+"""
+Inverted index held in memory and pickled to disk. Updates are persisted at
+most every `persist_interval` seconds and when the process exits.
+"""
+
+
+class PythonBackend:
+
+    K1 = 1.2  # BM25 term frequency saturation
+    B = 0.75  # BM25 length normalisation
+
+    def __init__(self, path, persist_interval=30):
+        self.path = path
+        self.persist_interval = persist_interval
+        self.lock = threading.RLock()
+        self.postings = None  # term: {item_id: weighted frequency}
+        self.lengths = {}  # item_id: weighted length
+        self.total_length = 0.0  # sum of the lengths, for the average
+        self.terms = {}  # item_id: the terms of the item, for removals
+        self.vocabulary = None  # sorted terms for prefix lookups
+        self.dirty = False
+        self.persisted = time.monotonic()
+        atexit.register(self.persist)
+
+    def _load(self):
+        if self.postings is not None:
+            return
+        try:
+            with open(self.path, 'rb') as index_file:
+                self.postings, self.lengths, self.terms = pickle.load(
+                    index_file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            self.rebuild()
+        else:
+            self.total_length = sum(self.lengths.values())
+
+    def _add(self, item_id, name, description):
+        weights = Counter()
+        for term in tokenize(name):
+            weights[term] += NAME_WEIGHT
+        for term in tokenize(description):
+            weights[term] += 1.0
+
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self.vocabulary = None
+            self.postings[term][item_id] = weight
+        self.lengths[item_id] = sum(weights.values())
+        self.total_length += self.lengths[item_id]
+        self.terms[item_id] = list(weights)
+
+    def _remove(self, item_id):
+        for term in self.terms.pop(item_id, ()):
+            postings = self.postings[term]
+            postings.pop(item_id, None)
+            if not postings:
+                del self.postings[term]
+                self.vocabulary = None
+        self.total_length -= self.lengths.pop(item_id, 0)
+
+    def _changed(self):
+        self.dirty = True
+        if time.monotonic() - self.persisted > self.persist_interval:
+            self.persist()
+
+    def create_table(self):
+        pass
+
+    def index_item(self, item):
+        self.index_items([item])
+
+    def index_items(self, items):
+        with self.lock:
+            self._load()
+            for item in items:
+                self._remove(item.item_id)
+                self._add(item.item_id, item.name, item.description)
+            self._changed()
+
+    def remove_item(self, item_id):
+        with self.lock:
+            self._load()
+            self._remove(item_id)
+            self._changed()
+
+    def rebuild(self):
+        with self.lock:
+            self.postings = defaultdict(dict)
+            self.lengths, self.terms = {}, {}
+            self.total_length = 0.0
+            self.vocabulary = None
+            rows = Item.objects.values_list(
+                'item_id', 'name', 'description').iterator(chunk_size=2000)
+            for item_id, name, description in rows:
+                self._add(item_id, name, description)
+            self.dirty = True
+            self.persist()
+
+    """
+    Writes the index to a temporary file and moves it into place so that a
+    crash never leaves a half written index behind
+    """
+
+    def persist(self):
+        with self.lock:
+            if not self.dirty or self.postings is None:
+                return
+            temporary = f'{self.path}.tmp'
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                            exist_ok=True)
+                with open(temporary, 'wb') as index_file:
+                    pickle.dump((self.postings, self.lengths, self.terms),
+                                index_file, pickle.HIGHEST_PROTOCOL)
+                os.replace(temporary, self.path)
+            except OSError:
+                logger.exception('Could not persist the search index')
+                return
+            self.dirty = False
+            self.persisted = time.monotonic()
+
+    """
+    Same contract as FTS5Backend.search: every term must match, the last
+    one as a prefix, and the results are ranked with BM25
+    """
+
+    def search(self, terms, offset, limit):
+        with self.lock:
+            self._load()
+            *whole, last = terms
+            matches = [self.postings.get(term, {}) for term in whole]
+            if self.vocabulary is None:
+                self.vocabulary = sorted(self.postings)
+
+            # The terms starting with the last one are adjacent once sorted
+            prefixed = {}
+            start = bisect.bisect_left(self.vocabulary, last)
+            for term in self.vocabulary[start:]:
+                if not term.startswith(last):
+                    break
+                for item_id, weight in self.postings[term].items():
+                    prefixed[item_id] = prefixed.get(item_id, 0) + weight
+            matches.append(prefixed)
+
+            matches.sort(key=len)
+            found = set(matches[0])
+            for postings in matches[1:]:
+                found.intersection_update(postings)
+            if not found:
+                return []
+
+            count = len(self.lengths)
+            average = self.total_length / count
+            scores = {}
+            for postings in matches:
+                idf = math.log(1 + (count - len(postings) + 0.5) /
+                               (len(postings) + 0.5))
+                for item_id in found:
+                    frequency = postings[item_id]
+                    norm = 1 - self.B + self.B * (
+                        self.lengths[item_id] / average)
+                    scores[item_id] = scores.get(item_id, 0) + idf * (
+                        frequency * (self.K1 + 1) /
+                        (frequency + self.K1 * norm))
+
+        ranked = heapq.nsmallest(
+            offset + limit, found,
+            key=lambda item_id: (-scores[item_id], item_id))
+        return ranked[offset:]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+"""
+Returns the search backend chosen by the SEARCH_BACKEND setting: 'fts5',
+'python' or 'auto' (FTS5 where the database supports it)
+"""
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            choice = getattr(settings, 'SEARCH_BACKEND', 'auto')
+            if choice == 'fts5' or (
+                    choice == 'auto' and FTS5Backend.is_available()):
+                _backend = FTS5Backend()
+            else:
+                _backend = PythonBackend(
+                    getattr(settings, 'SEARCH_INDEX_PATH',
+                            settings.BASE_DIR / 'search_index.pickle'))
+        return _backend
+
+
+"""
+One page of search results
+"""
+
+
+class SearchPage:
+
+    def __init__(self, items, number, has_next):
+        self.items = items
+        self.number = number
+        self.next_number = number + 1 if has_next else None
+        self.previous_number = number - 1 if number > 1 else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+"""
+Returns the given page of the items matching the query, best match first
+"""
+
+
+def search(query, page=1, page_size=PAGE_SIZE, backend=None):
+    terms = tokenize(query)[:MAX_TERMS]
+    if not terms:
+        return SearchPage([], page, False)
+
+    backend = backend or get_backend()
+    item_ids = backend.search(terms, (page - 1) * page_size, page_size + 1)
+    has_next = len(item_ids) > page_size
+    item_ids = item_ids[:page_size]
+
+    items = Item.objects.in_bulk(item_ids)
+    return SearchPage([items[item_id] for item_id in item_ids
+                       if item_id in items], page, has_next)
@@ -0,0 +1,103 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_catalogue_version, invalidate_item
+from .cart import merge_anonymous_cart
+from .images import schedule_derivatives
+from .search import get_backend
+from .models import Item, Review
+
+'''
+Signal receivers keeping the caches of the shop in sync with the models.
+Connected when the app is ready (see PagesConfig.ready).
+'''
+
+
+""" 
+Drop the cached item page when the item is saved or deleted
+"""
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_changed(sender, instance, **kwargs):
+    invalidate_item(instance.item_id)
+
+
+""" 
+Change the catalogue validators when an item is deleted
+"""
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted_catalogue(sender, instance, **kwargs):
+    bump_catalogue_version()
+
+
+""" 
+Keep the search index in step with the items
+"""
+
+
+@receiver(post_save, sender=Item)
+def item_saved_search(sender, instance, **kwargs):
+    get_backend().index_item(instance)
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted_search(sender, instance, **kwargs):
+    get_backend().remove_item(instance.item_id)
+
+
+""" 
+Resize a new or replaced item picture in the background
+"""
+
+
+@receiver(post_save, sender=Item)
+def item_picture_saved(sender, instance, **kwargs):
+    if instance.picture and not instance.picture_hash:
+        schedule_derivatives(instance.item_id)
+
+
+""" 
+Drop the cached item page when one of its reviews is saved or deleted
+"""
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    invalidate_item(instance.item_id)
+
+
+""" 
+Take a deleted review out of the rating summary of its item
+"""
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    rating = getattr(instance, '_saved_rating', instance.rating)
+    Item.objects.filter(pk=instance.item_id).adjust_rating(-1, -rating)
+
+
+""" 
+Keep the cart a user filled before logging in
+"""
+
+
+@receiver(user_logged_in)
+def user_logged_in_cart(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        merge_anonymous_cart(request)
+
+
+""" 
+Create the search table along with the other tables of the app
+"""
+
+
+def create_search_table(sender, **kwargs):
+    get_backend().create_table()
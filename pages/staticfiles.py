@@ -0,0 +1,153 @@
+import gzip
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.finders import BaseFinder
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import brotli
+except ImportError:  # .br variants are only written when it is installed
+    brotli = None
+
+'''
+Static asset pipeline. `manage.py collectstatic` bundles and minifies the
+CSS of every page, names every file after a hash of its content, writes
+.gz and .br variants next to them and a manifest (staticfiles.json) that
+{% static %} resolves names through. StaticAssetMiddleware (pages/middleware)
+serves the result with immutable cache headers.
+'''
+
+# Pages with their own stylesheet, each gets base.css + its own in a bundle
+PAGES = [
+    'about-us', 'cart', 'checkout', 'home', 'item', 'login', 'my-orders',
+    'profile', 'review-item',
+]
+
+# Bundle name: the stylesheets concatenated into it, in order
+BUNDLES = {'css/base.bundle.css': ['css/base.css']}
+BUNDLES.update({f'css/{page}.bundle.css': ['css/base.css', f'css/{page}.css']
+                for page in PAGES})
+
+# Files worth compressing and the size under which it is not worth it
+COMPRESSIBLE = {'.css', '.js', '.svg', '.txt', '.json', '.html', '.map'}
+MIN_COMPRESS_SIZE = 256
+
+# Name of a file that carries a content hash, which never changes content:
+# name.0123456789ab.css from the manifest, name-640w-0123456789ab.jpg from
+# the item picture derivatives
+HASHED_NAME = re.compile(r'[.-][0-9a-f]{12}\.\w+$')
+
+_COMMENTS = re.compile(r'/\*.*?\*/', re.S)
+_SPACE = re.compile(r'\s+')
+_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+"""
+Returns a stylesheet without comments and needless whitespace
+"""
+
+
+def minify_css(css):
+    css = _COMMENTS.sub('', css)
+    css = _SPACE.sub(' ', css)
+    css = _PUNCTUATION.sub(r'\1', css)
+    css = css.replace(': ', ':').replace(';}', '}')
+    return css.strip() + '\n'
+
+
+"""
+Returns the folder the built bundles are kept in
+"""
+
+
+def bundle_root():
+    return getattr(settings, 'STATIC_BUNDLE_ROOT',
+                   settings.BASE_DIR / 'static_bundles')
+
+
+"""
+Finder serving the CSS bundles, both to runserver and to collectstatic. A
+bundle is rebuilt whenever one of its stylesheets is newer.
+"""
+
+
+class BundleFinder(BaseFinder):
+
+    @property
+    def storage(self):
+        return FileSystemStorage(location=bundle_root())
+
+    def check(self, **kwargs):
+        return []
+
+    def find(self, path, all=False):
+        if path not in BUNDLES:
+            return [] if all else None
+        built = self.build(path)
+        return [built] if all else built
+
+    def list(self, ignore_patterns):
+        for path in BUNDLES:
+            self.build(path)
+            yield path, self.storage
+
+    def build(self, path):
+        sources = [finders.find(source) for source in BUNDLES[path]]
+        target = Path(self.storage.path(path))
+        if target.exists() and all(
+                os.path.getmtime(source) <= target.stat().st_mtime
+                for source in sources):
+            return str(target)
+
+        css = ''.join(Path(source).read_text() for source in sources)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and moved into place, a request may be reading it
+        with tempfile.NamedTemporaryFile(
+                'w', dir=target.parent, suffix='.tmp', delete=False) as built:
+            built.write(minify_css(css))
+        os.replace(built.name, target)
+        return str(target)
+
+
+"""
+Manifest storage that also writes compressed variants of the hashed files.
+Names missing from the manifest (e.g. before the first collectstatic) fall
+back to the unhashed name instead of failing the page.
+"""
+
+
+class ShopStaticStorage(ManifestStaticFilesStorage):
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name  # not collected yet
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            for name in set(self.hashed_files.values()):
+                self.compress(name)
+
+    def compress(self, name):
+        path = Path(self.path(name))
+        if path.suffix not in COMPRESSIBLE:
+            return
+        data = path.read_bytes()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+
+        variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data):
+                Path(f'{path}{suffix}').write_bytes(compressed)
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import (
+    DjangoTemplates, Template, TemplateDoesNotExist, reraise)
+
+'''
+Per request performance numbers: database queries and time, template render
+time and total latency. RequestStatsMiddleware collects them for every
+request and adds them to a rolling window per URL name, from which the
+percentiles shown at the staff-only stats page are computed.
+'''
+
+# Number of most recent requests kept per URL name
+WINDOW = getattr(settings, 'REQUEST_STATS_WINDOW', 1000)
+
+# Stats of the request being handled by the current thread or task
+_current = ContextVar('request_stats', default=None)
+
+
+"""
+Numbers collected while handling a single request
+"""
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0  # seconds
+        self.template_time = 0.0  # seconds
+
+    """
+    Returns the value of the Server-Timing header (durations in ms)
+    """
+
+    def server_timing(self, total):
+        return (f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} '
+                f'queries", tpl;dur={self.template_time * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}')
+
+
+"""
+Database execute wrapper timing every query into the current request stats.
+The stats travel in a context variable, so queries run by sync_to_async on
+another thread and connection are counted too.
+"""
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+
+
+"""
+Installs record_query on every new database connection (connection_created
+receiver, connected in PagesConfig.ready)
+"""
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        # First, so that the wrappers pushed by execute_wrapper() blocks
+        # that are already open still pop their own
+        connection.execute_wrappers.insert(0, record_query)
+
+
+"""
+Makes stats the stats of the current request, returns a token for reset
+"""
+
+
+def start(stats):
+    return _current.set(stats)
+
+
+def finish(token):
+    _current.reset(token)
+
+
+"""
+Rolling window of the last WINDOW values of every metric per URL name
+"""
+
+
+class Histogram:
+
+    METRICS = ('total_ms', 'db_ms', 'template_ms', 'queries')
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = defaultdict(
+            lambda: {metric: deque(maxlen=self.window)
+                     for metric in self.METRICS})
+        self.counts = defaultdict(int)
+
+    def record(self, name, stats, total):
+        with self.lock:
+            samples = self.samples[name]
+            samples['total_ms'].append(total * 1000)
+            samples['db_ms'].append(stats.db_time * 1000)
+            samples['template_ms'].append(stats.template_time * 1000)
+            samples['queries'].append(stats.queries)
+            self.counts[name] += 1
+
+    """
+    Returns the p50/p95/p99 of every metric per URL name. Sorting happens
+    here so that recording a request stays O(1).
+    """
+
+    def snapshot(self):
+        with self.lock:
+            samples = {name: {metric: sorted(values)
+                              for metric, values in metrics.items()}
+                       for name, metrics in self.samples.items()}
+            counts = dict(self.counts)
+
+        report = {}
+        for name, metrics in sorted(samples.items()):
+            report[name] = {'requests': counts[name]}
+            for metric, values in metrics.items():
+                report[name][metric] = {
+                    f'p{percent}': round(values[min(
+                        len(values) - 1, len(values) * percent // 100)], 2)
+                    for percent in (50, 95, 99)
+                }
+        return report
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+histogram = Histogram()
+
+
+"""
+Django template backend timing every render into the current request stats
+"""
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    # Loading is timed as rendering too, it is where templates are parsed
+    def get_template(self, template_name):
+        stats = _current.get()
+        started = time.perf_counter()
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+        finally:
+            if stats is not None:
+                stats.template_time += time.perf_counter() - started
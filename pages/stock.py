@@ -0,0 +1,97 @@
+import random
+import time
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Item
+
+'''
+Stock reservation service. Reserving moves units from the available stock
+(quantity_stock - quantity_order) to quantity_order with a conditional
+UPDATE, so two checkouts can never sell the same unit twice.
+'''
+
+MAX_ATTEMPTS = 5  # Attempts of a transaction that keeps hitting conflicts
+RETRY_DELAY = 0.05  # Base delay between attempts (seconds)
+
+
+"""
+Raised when some of the items do not have enough available stock
+"""
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, item_ids):
+        super().__init__(f'Not enough stock for items {sorted(item_ids)}')
+        self.item_ids = set(item_ids)
+
+
+"""
+Returns the condition matching the items that can cover their quantity
+"""
+
+
+def _available(quantities):
+    condition = Q(pk__in=[])
+    for item_id, quantity in quantities.items():
+        condition |= Q(pk=item_id,
+                       quantity_stock__gte=F('quantity_order') + quantity)
+    return condition
+
+
+"""
+Returns the UPDATE expression adding the reserved quantity to each item
+"""
+
+
+def _reserved(quantities):
+    return F('quantity_order') + Case(
+        *[When(pk=item_id, then=Value(quantity))
+          for item_id, quantity in quantities.items()],
+        default=Value(0), output_field=IntegerField())
+
+
+"""
+Reserves the given {item_id: quantity} in one conditional UPDATE. Must run
+inside a transaction, which is left to roll back when OutOfStock is raised.
+"""
+
+
+def reserve_stock(quantities):
+    if not quantities:
+        return
+
+    # Lock the rows in a fixed order where the backend can, so concurrent
+    # reservations of the same items wait for each other instead of deadlocking
+    if connection.features.has_select_for_update:
+        list(Item.objects.select_for_update().filter(
+            pk__in=quantities).order_by('pk').values_list('pk', flat=True))
+
+    available = _available(quantities)
+    # The stock decides which items the in-stock catalogue lists
+    reserved = Item.objects.filter(available).update(
+        quantity_order=_reserved(quantities), modified=timezone.now())
+
+    if reserved != len(quantities):
+        covered = Item.objects.filter(available).values_list('pk', flat=True)
+        raise OutOfStock(set(quantities) - set(covered))
+
+
+"""
+Runs func in a transaction, retrying with a jittered backoff when the
+database reports a lock conflict or a deadlock.
+"""
+
+
+def run_with_retry(func, *args, **kwargs):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError:
+            if attempt == MAX_ATTEMPTS or connection.in_atomic_block:
+                raise  # out of attempts or nested in an outer transaction
+            time.sleep(RETRY_DELAY * attempt * (1 + random.random()))
@@ -0,0 +1,247 @@
+import logging
+import random
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Address, Item, Job, Order, OrderDetails, Profile
+
+'''
+Task queue for the work that does not have to happen inside a request.
+
+enqueue() stores a Job in the current transaction, so a job exists exactly
+when the work that asked for it was committed. TASK_RUNNER then decides who
+runs it:
+    'thread'  a small pool in the web process, right after the commit, with
+              the run_workers command picking up retries and leftovers
+    'worker'  only the run_workers command
+    'eager'   inline in enqueue(), for tests
+A job is claimed with a conditional UPDATE and a lease, so several workers
+never run the same job, and a job whose worker died is run again once its
+lease expires. Failures are retried with an exponential backoff.
+'''
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 10  # Seconds before the first retry, doubled every attempt
+LEASE = 300  # Seconds a worker may run a job before others may take it
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tasks')
+
+
+"""
+Marks a function as a task run by the queue, with the number of attempts
+before it is given up
+"""
+
+
+def task(max_attempts=3):
+    def decorator(func):
+        func.max_attempts = max_attempts
+        return func
+    return decorator
+
+
+def _runner():
+    return getattr(settings, 'TASK_RUNNER', 'thread')
+
+
+"""
+Queues func(*args) and returns its Job. Arguments must be JSON
+serialisable. With a key, enqueuing again returns the existing job.
+"""
+
+
+def enqueue(func, *args, key=None, delay=0):
+    job = Job(task=f'{func.__module__}.{func.__qualname__}', args=list(args),
+              key=key, max_attempts=getattr(func, 'max_attempts', 3),
+              run_at=timezone.now() + timedelta(seconds=delay))
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if key is None:
+            raise
+        return Job.objects.get(key=key)
+
+    if _runner() == 'eager':
+        run_job(job.job_id)
+    elif _runner() == 'thread' and not delay:
+        transaction.on_commit(lambda: _submit(job.job_id))
+    return job
+
+
+def _submit(job_id, delay=0):
+    if delay:
+        timer = threading.Timer(delay, _submit, (job_id,))
+        timer.daemon = True
+        timer.start()
+    else:
+        _executor.submit(_run_in_background, job_id)
+
+
+"""
+Runs a job on a pool thread, which has its own connection
+"""
+
+
+def _run_in_background(job_id):
+    try:
+        retry_in = run_job(job_id)
+        if retry_in is not None:
+            _submit(job_id, retry_in)
+    finally:
+        connections.close_all()
+
+
+"""
+Claims the job if it is due and nobody else holds it
+"""
+
+
+def claim(job_id):
+    now = timezone.now()
+    return Job.objects.filter(pk=job_id, status=Job.QUEUED,
+                              run_at__lte=now).update(
+        status=Job.RUNNING, attempts=F('attempts') + 1,
+        locked_until=now + timedelta(seconds=LEASE)) == 1
+
+
+"""
+Claims and runs a job. Returns the seconds until its retry if it failed
+and has attempts left, otherwise None.
+"""
+
+
+def run_job(job_id):
+    if not claim(job_id):
+        return None
+    job = Job.objects.get(pk=job_id)
+
+    try:
+        import_string(job.task)(*job.args)
+    except Exception:
+        logger.exception('Task %s failed (attempt %s)', job.task,
+                         job.attempts)
+        error = traceback.format_exc()
+    else:
+        Job.objects.filter(pk=job_id).update(
+            status=Job.DONE, locked_until=None, last_error='')
+        return None
+
+    if job.attempts >= job.max_attempts:
+        Job.objects.filter(pk=job_id).update(
+            status=Job.FAILED, locked_until=None, last_error=error)
+        return None
+
+    retry_in = RETRY_DELAY * 2 ** (job.attempts - 1) * (1 + random.random())
+    Job.objects.filter(pk=job_id).update(
+        status=Job.QUEUED, locked_until=None, last_error=error,
+        run_at=timezone.now() + timedelta(seconds=retry_in))
+    return retry_in
+
+
+"""
+Requeues the jobs whose worker died before finishing them
+"""
+
+
+def release_expired():
+    return Job.objects.filter(
+        status=Job.RUNNING, locked_until__lt=timezone.now()).update(
+        status=Job.QUEUED, locked_until=None)
+
+
+"""
+Returns the ids of up to `limit` due jobs, oldest first
+"""
+
+
+def due_jobs(limit=100):
+    return list(Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=timezone.now()).order_by(
+        'run_at', 'job_id').values_list('job_id', flat=True)[:limit])
+
+
+"""
+Sends the order confirmation email
+"""
+
+
+@task(max_attempts=5)
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user__user').get(pk=order_id)
+    user = order.user.user
+    if not user.email:
+        return
+
+    lines = OrderDetails.objects.filter(order_id=order)
+    body = '\n'.join(f'{line.quantity} x {line.item_name}' for line in lines)
+    send_mail(f'Your order no. {order.order_id}',
+              f'Thank you for your order!\n\n{body}\n',
+              None, [user.email])
+
+
+"""
+Recomputes the units on order of the items of an order from the lines of
+the orders still holding stock (the units of shipped orders were taken off
+the stock by Order.save), fixing any drift of the counters kept by
+reserve_stock. The items are locked before their lines are summed, so a
+checkout reserving them at the same time is either counted or waited for.
+"""
+
+
+@task()
+def reconcile_inventory(order_id):
+    from .cache import invalidate_item
+
+    with transaction.atomic():
+        # In a fixed order, like reserve_stock, so the two never deadlock
+        item_ids = list(Item.objects.select_for_update().filter(
+            pk__in=OrderDetails.objects.filter(order_id=order_id).values(
+                'item_id')).order_by('pk').values_list('pk', flat=True))
+        ordered = dict(OrderDetails.objects.filter(
+            item_id__in=item_ids, order_id__status__in=Order.HOLDING_STOCK
+        ).values('item_id').annotate(units=Sum('quantity')).order_by(
+        ).values_list('item_id', 'units'))
+
+        corrected = []
+        for item_id in item_ids:
+            units = ordered.get(item_id, 0)
+            if Item.objects.filter(pk=item_id).exclude(
+                    quantity_order=units).update(
+                    quantity_order=units, modified=timezone.now()):
+                logger.warning('Corrected the units on order of item %s',
+                               item_id)
+                corrected.append(item_id)
+
+    for item_id in corrected:
+        invalidate_item(item_id)
+
+
+"""
+Sets up the account of a new user off the signup request: creates the
+address given at signup, unless an earlier attempt did, and sends the
+welcome email
+"""
+
+
+@task(max_attempts=5)
+def set_up_profile(profile_id, address):
+    profile = Profile.objects.select_related('user').get(pk=profile_id)
+    if not Address.objects.filter(user=profile).exists():
+        Address.objects.create(user=profile, **address)
+
+    user = profile.user
+    if user.email:
+        send_mail('Welcome to the shop',
+                  f'Hi {user.first_name or user.username}, '
+                  f'thank you for signing up!', None, [user.email])
@@ -0,0 +1,35 @@
+from django import template
+from django.utils.html import format_html
+
+from pages import images
+
+register = template.Library()
+
+# Rendered width of each size, used for the sizes attribute
+DISPLAY_WIDTHS = {
+    'grid': '(max-width: 800px) 90vw, 320px',
+    'detail': '(max-width: 800px) 90vw, 640px',
+}
+
+""" 
+Renders the picture of an item at the given size ('grid' or 'detail') with
+a WebP source and a JPEG fallback. Falls back to the original picture until
+the resized copies have been generated.
+Usage: {% item_picture item 'grid' 'item-image' %}
+"""
+
+
+@register.simple_tag
+def item_picture(item, size, css_class=''):
+    if not item.picture_hash:
+        return format_html('<img class="{}" src="{}" alt="{}" />',
+                           css_class, item.get_image(), item.name)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}" />'
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}" />'
+        '</picture>',
+        item.get_srcset(size, 'webp'), DISPLAY_WIDTHS[size],
+        css_class, item.get_image(size), item.get_srcset(size),
+        DISPLAY_WIDTHS[size], item.name)
@@ -1,3 +1,1526 @@
-from django.test import TestCase
+import asyncio
+from datetime import date
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+import gzip
+import json
+import re
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core import signals
+from django.core.management import call_command
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Sum
+from django.core import mail
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+
+from PIL import Image
+
+from myapp import asgi
+
+from . import admin as shop_admin
+from . import (
+    bench, catalogue, images, imports, search, staticfiles, stats, tasks,
+    views)
+from .cache import get_item_page
+from .checkout import EmptyCart, place_order
+from .models import (
+    Address, CartDetails, Item, Job, Order, OrderDetails, Profile, Review)
+from .stock import OutOfStock, reserve_stock, run_with_retry
 
 # Create your tests here.
+
+
+"""
+Helpers shared by the test cases below
+"""
+
+
+def make_item(name='Shirt', price='10.00', **kwargs):
+    return Item.objects.create(name=name, price=Decimal(price), **kwargs)
+
+
+def run_in_threads(target, arguments):
+    errors = []
+
+    def run(argument):
+        try:
+            target(argument)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()  # every thread has its own connection
+
+    threads = [threading.Thread(target=run, args=(argument,))
+               for argument in arguments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def count_queries(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    return response, len(queries)
+
+
+"""
+Order history should cost the same number of queries at any order count
+"""
+
+
+class OrderHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.client.force_login(self.user)
+        self.shirt = make_item('Shirt', '10.50')
+        self.cap = make_item('Cap', '4.25')
+
+    def place_orders(self, count, total='25.25', items=None):
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user.profile, total=Decimal(total), line_count=2)
+            shirt, cap = items() if items else (self.shirt, self.cap)
+            for item, quantity in ((shirt, 2), (cap, 1)):
+                OrderDetails.objects.create(
+                    order_id=order, item=item, quantity=quantity,
+                    unit_price=item.price, item_name=item.name)
+
+    def test_history_reads_stored_totals(self):
+        self.place_orders(1)
+        order = Order.objects.history_for(self.user.profile).get()
+
+        self.assertEqual(order.total, Decimal('25.25'))
+        self.assertEqual([line.subtotal for line in order.lines],
+                         [Decimal('21.00'), Decimal('4.25')])
+
+    def test_history_and_status_use_an_index(self):
+        plan = Order.objects.filter(user=self.user.profile).order_by(
+            '-created_date').explain()
+        self.assertIn('order_user_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertIn('order_status_idx',
+                      Order.objects.filter(status='P').explain())
+
+    def test_history_keeps_the_ordered_prices_without_joining_items(self):
+        self.place_orders(1)
+        Item.objects.filter(pk=self.shirt.pk).update(
+            name='Renamed', price=Decimal('99.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            order = Order.objects.history_for(self.user.profile).get()
+        self.assertEqual(
+            [(line.item_name, line.subtotal) for line in order.lines],
+            [('Shirt', Decimal('21.00')), ('Cap', Decimal('4.25'))])
+        self.assertFalse(any('JOIN "pages_item"' in query['sql']
+                             for query in queries))
+
+    def test_export_never_reads_items(self):
+        self.place_orders(2)
+        self.user.is_staff = True
+        self.user.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/exports/order-lines.csv')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'order_line,order,created,status,item,'
+                                   'item_name,unit_price,quantity')
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[1].endswith(',Shirt,10.50,2'))
+        self.assertFalse(any('pages_item' in query['sql']
+                             for query in queries))
+
+    def test_snapshot_migration(self):
+        self.place_orders(1)
+        OrderDetails.objects.update(unit_price=0, item_name='')
+        migration = import_module('pages.migrations.0008_orderdetails_snapshot')
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            migration.snapshot_items(django_apps, None)
+        lines = OrderDetails.objects.values_list('item_name', 'unit_price')
+        self.assertEqual(sorted(lines), [('Cap', Decimal('4.25')),
+                                         ('Shirt', Decimal('10.50'))])
+
+    def test_backfill(self):
+        self.place_orders(2, total='0')
+        Order.objects.create(user=self.user.profile, total=5, line_count=1)
+        out = StringIO()
+        call_command('backfill_order_totals', batch_size=1, stdout=out)
+        self.assertIn('Backfilled the totals of 2 orders.', out.getvalue())
+        self.assertEqual(
+            sorted(Order.objects.values_list('total', 'line_count')),
+            [(Decimal('0'), 0), (Decimal('25.25'), 2), (Decimal('25.25'), 2)])
+
+    def test_query_count_is_constant(self):
+        # Every order gets its own items so their names are not shared
+        numbers = iter(range(100))
+
+        def items():
+            number = next(numbers)
+            return (make_item(f'Shirt {number}', '10.50'),
+                    make_item(f'Cap {number}', '4.25'))
+
+        self.place_orders(1, items=items)
+        response, few = count_queries(self.client, '/my-orders')
+        self.assertContains(response, 'Order Total: P25.25')
+
+        self.place_orders(20, items=items)
+        response, many = count_queries(self.client, '/my-orders')
+        self.assertEqual(few, many)
+
+
+"""
+Keyset pagination of the catalogue
+"""
+
+
+class CataloguePaginationTests(TestCase):
+
+    def setUp(self):
+        # Duplicate prices make the item_id tiebreak matter
+        for number in range(7):
+            make_item(f'Item {number}', f'{number % 3}.00')
+
+    def walk(self, sort, page_size=3):
+        names, page = [], catalogue.paginate(Item.objects.all(), sort,
+                                             page_size=page_size)
+        names += [item.name for item in page]
+        while page.has_next():
+            page = catalogue.paginate(Item.objects.all(), sort,
+                                      after=page.next_cursor,
+                                      page_size=page_size)
+            names += [item.name for item in page]
+        return names
+
+    def test_walk_visits_every_item_once_in_order(self):
+        for sort in catalogue.SORTS:
+            field = catalogue.SORTS[sort]
+            if sort.startswith('-'):
+                ordering = ['-' + field, '-item_id']
+            else:
+                ordering = [field, 'item_id']
+            expected = list(Item.objects.order_by(*ordering).values_list(
+                'name', flat=True))
+            self.assertEqual(self.walk(sort), expected, field)
+
+    def test_previous_page_mirrors_next_page(self):
+        first = catalogue.paginate(Item.objects.all(), 'price', page_size=3)
+        second = catalogue.paginate(Item.objects.all(), 'price',
+                                    after=first.next_cursor, page_size=3)
+        back = catalogue.paginate(Item.objects.all(), 'price',
+                                  before=second.prev_cursor, page_size=3)
+
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/', {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+"""
+Sorts and filters of the catalogue must be whitelisted and index-backed
+"""
+
+
+class CatalogueQueryTests(TestCase):
+
+    def setUp(self):
+        make_item('Apron', '3.00', quantity_stock=0)
+        make_item('Apple', '5.00', quantity_stock=4, quantity_order=1)
+        make_item('Banana', '1.00')
+
+    def plan(self, sort, **options):
+        field = catalogue.SORTS[sort]
+        ordering = ['-' + field if sort[0] == '-' else field, 'item_id']
+        items = catalogue.filter_items(Item.objects.all(), **options)
+        return items.order_by(*ordering).explain()
+
+    def test_filters(self):
+        filtered = catalogue.filter_items(
+            Item.objects.all(), max_price=Decimal('4.00'), prefix='Ap')
+        self.assertEqual([item.name for item in filtered], ['Apron'])
+
+        in_stock = catalogue.filter_items(Item.objects.all(), in_stock=True)
+        self.assertEqual(sorted(item.name for item in in_stock),
+                         ['Apple', 'Banana'])
+
+    def test_every_option_uses_an_index(self):
+        cases = [
+            ('name', {}, 'item_name_idx'),
+            ('-name', {}, 'item_name_idx'),
+            ('price', {}, 'item_price_idx'),
+            ('-price', {}, 'item_price_idx'),
+            ('price', {'min_price': 1, 'max_price': 4}, 'item_price_idx'),
+            ('name', {'prefix': 'Ap'}, 'item_name_idx'),
+            ('name', {'in_stock': True}, 'item_stock_name_idx'),
+            ('price', {'in_stock': True}, 'item_stock_price_idx'),
+            ('-rating', {}, 'item_rating_idx'),
+            ('-rating', {'in_stock': True}, 'item_stock_rating_idx'),
+        ]
+        for sort, options, index in cases:
+            with self.subTest(sort=sort, **options):
+                self.assertIn(index, self.plan(sort, **options))
+
+    def test_invalid_options_are_rejected(self):
+        for query in ({'filter': 'description'}, {'min_price': 'cheap'},
+                      {'max_price': '-1'}):
+            response = self.client.get('/', query)
+            self.assertEqual(response.status_code, 400)
+
+
+"""
+The item page is cached per item and invalidated by signals
+"""
+
+
+class ItemPageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['template_fragments'].clear()
+        self.item = make_item('Scarf', '7.00')
+        self.users = [User.objects.create_user(f'reviewer{number}')
+                      for number in range(3)]
+        self.url = f'/item/{self.item.item_id}/'
+
+    def test_miss_costs_three_queries_at_any_review_count(self):
+        for user in self.users:
+            Review.objects.create(item=self.item, user=user, rating=4)
+
+        # The validators of the page, then the item and its reviews
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'rated by reviewer2')
+
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_saves_and_deletes_invalidate_the_page(self):
+        self.client.get(self.url)
+        review = Review.objects.create(
+            item=self.item, user=self.users[0], review_text='Warm')
+        self.assertContains(self.client.get(self.url), 'Warm')
+
+        review.delete()
+        self.assertNotContains(self.client.get(self.url), 'Warm')
+
+        self.item.name = 'Wool scarf'
+        self.item.save()
+        self.assertContains(self.client.get(self.url), 'Wool scarf')
+
+    def test_missing_item_is_not_found(self):
+        self.assertEqual(self.client.get('/item/999/').status_code, 404)
+
+
+"""
+Item cards and review lists are cached as fragments keyed on Item.version
+"""
+
+
+class FragmentCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['template_fragments'].clear()
+        self.item = make_item('Beanie', '6.00')
+
+    def test_card_is_rendered_again_only_for_a_new_version(self):
+        self.assertContains(self.client.get('/'), 'Beanie')
+
+        # An update that skips save() keeps the version, and the card
+        Item.objects.filter(pk=self.item.pk).update(name='Toque')
+        self.assertContains(self.client.get('/'), 'Beanie')
+
+        self.item.refresh_from_db()
+        self.item.save()
+        self.assertEqual(self.item.version, 2)
+        self.assertContains(self.client.get('/'), 'Toque')
+
+    def test_review_edits_bump_the_version(self):
+        user = User.objects.create_user('knitter')
+        review = Review.objects.create(
+            item=self.item, user=user, rating=4, review_text='Itchy')
+        url = f'/item/{self.item.item_id}/'
+        self.assertContains(self.client.get(url), 'Itchy')
+
+        review.update_review(4, 'Soft after washing')
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.version, 3)
+        self.assertContains(self.client.get(url), 'Soft after washing')
+
+    def test_render_benchmark_reports_the_template_share(self):
+        for cached in (False, True):
+            with bench.render_settings(cached):
+                result = bench.run_render('index', [self.item.pk], 3)
+            self.assertEqual(result['latency']['count'], 3)
+            self.assertGreater(result['template_share'], 0)
+            self.assertLess(result['template_share'], 1)
+
+
+"""
+The catalogue and item pages answer revalidations with a 304
+"""
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.item = make_item('Mittens', '9.00')
+        self.url = f'/item/{self.item.item_id}/'
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_catalogue_costs_one_query(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.revalidate('/', response).status_code, 304)
+        self.assertEqual(len(queries), 1)
+        # The maximum is read from the end of the index, not a scan
+        plan = connection.cursor().execute(
+            f'EXPLAIN QUERY PLAN {queries[0]["sql"]}').fetchall()
+        self.assertNotIn('SCAN', str(plan))
+
+        self.item.save()
+        self.assertEqual(self.revalidate('/', response).status_code, 200)
+
+    def test_deletions_and_logins_change_the_catalogue_etag(self):
+        gloves = make_item('Gloves')
+        self.item.save()
+        response = self.client.get('/')
+        gloves.delete()  # not the latest change, only the version shows it
+        self.assertEqual(self.revalidate('/', response).status_code, 200)
+
+        response = self.client.get('/')
+        self.item.delete()
+        self.assertEqual(self.revalidate('/', response).status_code, 200)
+
+        response = self.client.get('/')
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.assertEqual(self.revalidate('/', response).status_code, 200)
+
+    def test_reviews_change_the_item_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+        self.assertEqual(self.revalidate(self.url, response).status_code, 304)
+
+        Review.objects.create(item=self.item,
+                              user=User.objects.create_user('critic'))
+        self.assertEqual(self.revalidate(self.url, response).status_code, 200)
+
+
+"""
+The migrations cover every change to the models
+"""
+
+
+class MigrationTests(TestCase):
+
+    def test_no_missing_migrations(self):
+        call_command('makemigrations', 'pages', check=True, dry_run=True,
+                     stdout=StringIO())
+
+
+"""
+Rating summaries on Item follow every review save and delete
+"""
+
+
+class RatingSummaryTests(TestCase):
+
+    def setUp(self):
+        self.item = make_item('Cap', '4.00')
+        self.users = [User.objects.create_user(f'rater{number}')
+                      for number in range(2)]
+
+    def summary(self):
+        self.item.refresh_from_db()
+        return (self.item.review_count, self.item.rating_total,
+                self.item.rating_average)
+
+    def test_summary_follows_reviews(self):
+        first, _ = Review.objects.get_or_create(
+            item=self.item, user=self.users[0])
+        first.update_review(2, 'Meh')
+        Review.objects.create(item=self.item, user=self.users[1], rating=5)
+        self.assertEqual(self.summary(), (2, 7, 3.5))
+
+        first = Review.objects.get(pk=first.pk)
+        first.update_review(4, 'Better')
+        self.assertEqual(self.summary(), (2, 9, 4.5))
+
+        first.delete()
+        self.assertEqual(self.summary(), (1, 5, 5.0))
+
+        Review.objects.all().delete()
+        self.assertEqual(self.summary(), (0, 0, 0.0))
+
+    def test_edits_from_stale_copies_do_not_drift(self):
+        review = Review.objects.create(item=self.item, user=self.users[0],
+                                       rating=3)
+        first, second = Review.objects.get(), Review.objects.get()
+        first.update_review(5, 'Great')
+        second.update_review(1, 'Broke')
+        self.assertEqual(self.summary(), (1, 1, 1.0))
+        self.assertEqual(Review.objects.get(pk=review.pk).rating, 1)
+
+    def test_rebuild_command(self):
+        Review.objects.create(item=self.item, user=self.users[0], rating=3)
+        Review.objects.create(item=self.item, user=self.users[1], rating=4)
+        Item.objects.update(review_count=9, rating_total=1, rating_average=0)
+        other = make_item('Shoes', '20.00', review_count=2, rating_total=6)
+
+        call_command('rebuild_ratings', stdout=StringIO())
+
+        self.assertEqual(self.summary(), (2, 7, 3.5))
+        other.refresh_from_db()
+        self.assertEqual(other.review_count, 0)
+
+    def test_rebuild_command_drops_the_cached_pages(self):
+        cache.clear()
+        Review.objects.create(item=self.item, user=self.users[0], rating=3)
+        other = make_item('Shoes', '20.00')
+        Item.objects.update(review_count=9, rating_total=1, rating_average=0)
+        for item_id in (self.item.item_id, other.item_id):
+            get_item_page(item_id)
+
+        call_command('rebuild_ratings', batch_size=1, stdout=StringIO())
+
+        item, _ = get_item_page(self.item.item_id)
+        self.assertEqual(item.review_count, 1)
+        item, _ = get_item_page(other.item_id)
+        self.assertEqual(item.review_count, 0)
+
+
+"""
+Checkout is one transaction with a fixed number of queries
+"""
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count):
+        for number in range(count):
+            item = make_item(f'Item {number}', '2.50', quantity_stock=10)
+            CartDetails.objects.create(user=self.user, item=item, quantity=2)
+
+    def checkout_queries(self, count):
+        self.fill_cart(count)
+        with CaptureQueriesContext(connection) as queries:
+            order = place_order(self.user)
+        return order, len(queries)
+
+    def test_query_count_is_constant(self):
+        _, few = self.checkout_queries(1)
+        order, many = self.checkout_queries(12)
+        self.assertEqual(few, many)
+        self.assertEqual(order.total, Decimal('60.00'))
+
+    def test_checkout_creates_lines_reserves_stock_and_clears_cart(self):
+        self.fill_cart(3)
+        response = self.client.get('/checkout/')
+        self.assertContains(response, 'Total: P15.00')
+
+        order = Order.objects.get()
+        self.assertEqual((order.total, order.line_count),
+                         (Decimal('15.00'), 3))
+        self.assertEqual(order.orderdetails_set.count(), 3)
+        self.assertEqual(
+            list(Item.objects.values_list('quantity_order', flat=True)),
+            [2, 2, 2])
+        self.assertFalse(CartDetails.objects.exists())
+
+    def test_shortfall_fails_the_order_cleanly(self):
+        self.fill_cart(2)
+        Item.objects.filter(name='Item 1').update(quantity_order=9)
+
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.user)
+
+        self.assertEqual(raised.exception.item_ids,
+                         {Item.objects.get(name='Item 1').pk})
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartDetails.objects.count(), 2)
+        self.assertEqual(
+            Item.objects.get(name='Item 0').quantity_order, 0)
+
+        response = self.client.get('/checkout/', follow=True)
+        self.assertContains(response, 'Not enough stock left for: Item 1')
+
+    def test_empty_cart_creates_no_order(self):
+        with self.assertRaises(EmptyCart):
+            place_order(self.user)
+        self.assertFalse(Order.objects.exists())
+        self.assertRedirects(self.client.get('/checkout/'), '/my-cart',
+                             fetch_redirect_response=False)
+
+
+@override_settings(TASK_RUNNER='worker')  # no jobs outliving the test
+class ParallelCheckoutTests(TransactionTestCase):
+
+    def test_parallel_checkouts(self):
+        item = make_item('Notebook', '1.00', quantity_stock=100)
+        users = [User.objects.create_user(f'buyer{number}')
+                 for number in range(8)]
+        for user in users:
+            CartDetails.objects.create(user=user, item=item, quantity=3)
+
+        # The same user twice: only one of the two checkouts gets the cart
+        errors = run_in_threads(place_order, users + users[:1])
+
+        self.assertEqual([type(error) for error in errors], [EmptyCart])
+        self.assertEqual(Order.objects.count(), 8)
+        self.assertEqual(OrderDetails.objects.count(), 8)
+        self.assertFalse(CartDetails.objects.exists())
+        item.refresh_from_db()
+        self.assertEqual(item.quantity_order, 24)
+
+
+class StockReservationStressTests(TransactionTestCase):
+
+    def test_no_oversell_under_parallel_reservations(self):
+        item = make_item('Flash sale', '1.00', quantity_stock=15)
+        attempts = 40
+
+        errors = run_in_threads(
+            lambda _: run_with_retry(reserve_stock, {item.pk: 1}),
+            range(attempts))
+
+        item.refresh_from_db()
+        self.assertEqual(item.quantity_order, 15)
+        self.assertEqual(len(errors), attempts - 15)
+        self.assertTrue(all(isinstance(error, OutOfStock)
+                            for error in errors))
+
+    def test_bench_reports_the_throughput(self):
+        item = make_item('Flash sale', '1.00', quantity_stock=10)
+        result = bench.run_reservations(item.pk, 16, threads=4)
+        self.assertEqual((result['reserved'], result['refused'],
+                          result['failed']), (10, 6, 0))
+        self.assertGreater(result['reservations_per_s'], 0)
+        self.assertEqual(result['latency']['count'], 16)
+
+
+"""
+Cart changes are buffered in the session until login, checkout or a timeout
+"""
+
+
+class SessionCartTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='pass')
+        self.shirt = make_item('Shirt', '10.00', quantity_stock=5)
+        self.cap = make_item('Cap', '4.00', quantity_stock=5)
+
+    def cart_lines(self):
+        return dict(CartDetails.objects.filter(user=self.user).values_list(
+            'item__name', 'quantity'))
+
+    def test_anonymous_cart_is_merged_at_login(self):
+        CartDetails.objects.create(user=self.user, item=self.cap)
+        self.client.get(f'/add-to-cart/{self.shirt.item_id}/')
+        self.client.get(f'/add-to-cart/{self.shirt.item_id}/')
+        self.assertContains(self.client.get('/my-cart/'), 'Total: P20.00')
+        self.assertEqual(CartDetails.objects.count(), 1)
+
+        self.client.post('/accounts/login/',
+                         {'username': 'shopper', 'password': 'pass'})
+        self.assertEqual(self.cart_lines(), {'Shirt': 2, 'Cap': 1})
+
+    def test_changes_are_written_at_checkout(self):
+        self.client.force_login(self.user)
+        self.client.get(f'/add-to-cart/{self.shirt.item_id}/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/add-to-cart/{self.cap.item_id}/')
+            self.client.get(f'/add-to-cart/{self.cap.item_id}/')
+            self.client.get(f'/remove-item/{self.cap.item_id}/')
+        self.assertFalse([query for query in queries
+                          if 'pages_cartdetails' in query['sql']])
+        self.assertEqual(self.cart_lines(), {})
+
+        response = self.client.get('/checkout/')
+        self.assertContains(response, 'Total: P14.00')
+        self.assertEqual(self.cart_lines(), {})
+        self.assertNotContains(self.client.get('/my-cart/'), 'Shirt')
+
+    def test_old_buffer_is_written_back(self):
+        self.client.force_login(self.user)
+        with mock.patch('pages.cart.CART_FLUSH_INTERVAL', -1):
+            self.client.get(f'/add-to-cart/{self.shirt.item_id}/')
+        self.assertEqual(self.cart_lines(), {'Shirt': 1})
+
+    def test_stale_session_keeps_the_other_lines(self):
+        phone, laptop = self.client_class(), self.client_class()
+        CartDetails.objects.create(user=self.user, item=self.shirt)
+        phone.force_login(self.user)
+        laptop.force_login(self.user)
+        phone.get('/my-cart/')
+        laptop.get('/my-cart/')  # both start from the stored Shirt
+
+        with mock.patch('pages.cart.CART_FLUSH_INTERVAL', -1):
+            laptop.get(f'/add-to-cart/{self.cap.item_id}/')
+            laptop.get(f'/add-to-cart/{self.shirt.item_id}/')
+            phone.get(f'/remove-item/{self.shirt.item_id}/')
+        self.assertEqual(self.cart_lines(), {'Cap': 1})
+
+
+"""
+Cart lines, subtotals and total come from a single query
+"""
+
+
+class CartSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+
+    def fill_cart(self, count):
+        for number in range(count):
+            item = make_item(f'Item {number}', '1.25')
+            CartDetails.objects.create(user=self.user, item=item,
+                                       quantity=number + 1)
+
+    def test_summary_is_one_query(self):
+        self.fill_cart(4)
+        with self.assertNumQueries(1):
+            lines, total = CartDetails.objects.filter(
+                user=self.user).summary()
+            names = [line.item.name for line in lines]
+
+        self.assertEqual(names, ['Item 0', 'Item 1', 'Item 2', 'Item 3'])
+        self.assertEqual([line.subtotal for line in lines],
+                         [Decimal('1.25'), Decimal('2.50'),
+                          Decimal('3.75'), Decimal('5.00')])
+        self.assertEqual(total, Decimal('12.50'))
+
+    def test_empty_summary(self):
+        self.assertEqual(
+            CartDetails.objects.filter(user=self.user).summary(), ([], 0))
+
+    def test_line_subtotal_uses_item_price(self):
+        item = make_item('Lamp', '4.20')
+        line = CartDetails.objects.create(user=self.user, item=item,
+                                          quantity=3)
+        self.assertEqual(line.get_subtotal(), Decimal('12.60'))
+
+    def test_sums_are_rounded_to_cents(self):
+        # 0.10 + 0.20 is 0.30000000000000004 in the floats SQLite sums
+        for name, price in (('Pin', '0.10'), ('Clip', '0.20')):
+            CartDetails.objects.create(user=self.user, quantity=1,
+                                       item=make_item(name, price))
+        lines, total = CartDetails.objects.filter(user=self.user).summary()
+        self.assertEqual(str(total), '0.30')
+        self.assertEqual([str(line.subtotal) for line in lines],
+                         ['0.10', '0.20'])
+
+        order = place_order(self.user)
+        self.assertEqual(str(Order.objects.get().total), '0.30')
+        self.assertEqual(str(order.total), '0.30')
+
+    def test_cart_view_costs_at_most_two_cart_queries(self):
+        self.client.force_login(self.user)
+        for storage in ('pages.cart.SessionCart', 'pages.cart.DatabaseCart'):
+            with self.settings(CART_STORAGE=storage):
+                for number in range(12):
+                    item = make_item(f'{storage} {number}', '1.00')
+                    self.client.get(f'/add-to-cart/{item.item_id}/')
+
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get('/my-cart/')
+
+            self.assertContains(response, 'Total: P12.00')
+            self.assertLessEqual(len([query for query in queries
+                                      if 'pages_' in query['sql']]), 2)
+
+
+"""
+Item pictures are resized into hashed WebP and JPEG copies
+"""
+
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        Image.new('RGBA', (1000, 500), 'red').save(self.root / 'big.png')
+
+        settings = self.settings(ITEM_IMAGE_ROOT=self.root,
+                                 IMAGE_DERIVATIVES_ASYNC=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_save_generates_every_size_and_format(self):
+        item = make_item('Poster', '9.00', picture='big.png')
+        item.refresh_from_db()
+        self.assertEqual(item.picture_hash, images.hash_file(
+            self.root / 'big.png'))
+
+        for widths in images.SIZES.values():
+            for width in widths:
+                for extension in images.FORMATS:
+                    name = images.derivative_name(
+                        item.picture, item.picture_hash, width, extension)
+                    with Image.open(self.root / name) as derivative:
+                        # Pictures are never enlarged
+                        self.assertEqual(derivative.width, min(width, 1000))
+
+        self.assertEqual(
+            item.get_image('grid'),
+            f'/static/items/derived/big-320w-{item.picture_hash}.jpg')
+        self.assertIn('640w', item.get_srcset('grid', 'webp'))
+
+    def test_replaced_picture_falls_back_until_resized(self):
+        item = make_item('Poster', '9.00')
+        Item.objects.filter(pk=item.pk).update(picture='old.png',
+                                               picture_hash='abc')
+        item = Item.objects.get(pk=item.pk)
+        item.picture = 'missing.png'
+        with self.assertLogs('pages.images', 'ERROR'):
+            item.save()
+
+        self.assertEqual(item.picture_hash, '')
+        self.assertEqual(item.get_image('grid'), '/static/items/missing.png')
+
+    def test_backfill_command(self):
+        item = make_item('Poster', '9.00')
+        Item.objects.filter(pk=item.pk).update(picture='big.png')
+
+        call_command('backfill_thumbnails', workers=1, stdout=StringIO())
+
+        item.refresh_from_db()
+        self.assertTrue(item.picture_hash)
+
+
+"""
+Full text search ranks the items and follows their saves and deletes
+"""
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        make_item('Wool scarf', '7.00', description='Warm winter scarf')
+        make_item('Linen shirt', '12.00', description='Light summer shirt')
+        make_item('Winter cap', '4.00', description='Knitted wool cap')
+        self.path = Path(tempfile.mkdtemp()) / 'index.pickle'
+        self.addCleanup(shutil.rmtree, self.path.parent)
+
+    def backends(self):
+        yield search.PythonBackend(self.path)
+        if search.FTS5Backend.is_available():
+            yield search.FTS5Backend()
+
+    def names(self, query, backend):
+        return [item.name for item in search.search(query, backend=backend)]
+
+    def test_results_are_ranked_and_prefixed(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                # A match in the name outranks one in the description
+                self.assertEqual(self.names('wool', backend),
+                                 ['Wool scarf', 'Winter cap'])
+                self.assertEqual(self.names('winter sca', backend),
+                                 ['Wool scarf'])
+                self.assertEqual(self.names('"; DROP', backend), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                backend.rebuild()
+                item = make_item('Denim jacket', '30.00')
+                backend.index_item(item)
+                self.assertEqual(self.names('denim', backend),
+                                 ['Denim jacket'])
+
+                item.delete()
+                backend.remove_item(item.item_id)
+                self.assertEqual(self.names('denim', backend), [])
+
+    @skipUnless(search.FTS5Backend.is_available(), 'SQLite without FTS5')
+    def test_fts5_table_is_filled_when_created(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {search.FTS_TABLE}')
+        backend = search.FTS5Backend()
+        backend.create_table()
+        self.assertEqual(self.names('linen', backend), ['Linen shirt'])
+
+    def test_python_index_keeps_the_total_length(self):
+        backend = search.PythonBackend(self.path)
+        backend.rebuild()
+        item = make_item('Denim jacket', '30.00', description='Blue denim')
+        backend.index_item(item)
+        backend.index_item(item)
+        backend.remove_item(Item.objects.get(name='Wool scarf').item_id)
+        self.assertEqual(backend.total_length, sum(backend.lengths.values()))
+
+        backend.persist()
+        loaded = search.PythonBackend(self.path)
+        self.assertEqual(loaded.search(['denim'], 0, 10), [item.item_id])
+        self.assertEqual(loaded.total_length, backend.total_length)
+
+    def test_python_index_is_persisted(self):
+        backend = search.PythonBackend(self.path)
+        backend.rebuild()
+        self.assertEqual(self.names('linen', search.PythonBackend(self.path)),
+                         ['Linen shirt'])
+
+    def test_search_page(self):
+        response = self.client.get('/search/', {'q': 'summer'})
+        self.assertContains(response, 'Linen shirt')
+        self.assertNotContains(response, 'Wool scarf')
+        self.assertEqual(
+            self.client.get('/search/', {'page': '0'}).status_code, 400)
+
+
+class RequestStatsTests(TestCase):
+
+    def setUp(self):
+        stats.histogram.clear()
+        make_item('Shirt', '10.00')
+
+    def test_server_timing_header(self):
+        response = self.client.get('/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+
+    def test_percentiles_per_url_name(self):
+        for _ in range(3):
+            self.client.get('/')
+        self.client.get('/about-us/')
+
+        report = stats.histogram.snapshot()
+        self.assertEqual(report['home']['requests'], 3)
+        self.assertEqual(report['about us']['requests'], 1)
+        self.assertGreater(report['home']['queries']['p50'], 0)
+        self.assertGreater(report['home']['template_ms']['p99'], 0)
+
+    def test_window_keeps_recent_requests(self):
+        histogram = stats.Histogram(window=10)
+        for total in range(100):
+            histogram.record('home', stats.RequestStats(), total / 1000)
+        report = histogram.snapshot()['home']
+        self.assertEqual(report['requests'], 100)
+        self.assertEqual(report['total_ms']['p50'], 95)
+        self.assertEqual(report['total_ms']['p99'], 99)
+
+    def test_stats_page_is_staff_only(self):
+        user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/stats/').status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get('/stats/')
+        self.assertEqual(response.status_code, 200)
+        # Only the redirected request, this one is recorded once answered
+        self.assertEqual(response.json()['stats']['requests'], 1)
+
+
+"""
+The benchmark suite should seed a shop and drive every route without errors
+"""
+
+
+@override_settings(TASK_RUNNER='worker')  # no jobs outliving the test
+class BenchmarkTests(TransactionTestCase):
+
+    def test_seed_and_drive_every_route(self):
+        user_ids, item_ids = bench.seed_shop(
+            users=3, items=20, reviews=30, orders=10)
+        self.assertEqual(Review.objects.count(), 30)
+        self.assertEqual(OrderDetails.objects.count(), 30)
+        self.assertEqual(Item.objects.filter(review_count__gt=0).count(),
+                         Review.objects.values('item').distinct().count())
+
+        clients = bench.logged_in_clients(user_ids)
+        with bench.live_server() as address:
+            cookies = bench.session_cookies(clients)
+            for route in bench.ROUTES:
+                with self.subTest(route=route):
+                    result = bench.run_client(route, clients, item_ids, 3)
+                    self.assertEqual(result['errors'], 0)
+                    self.assertGreater(result['queries']['mean'], 0)
+
+                    result = bench.run_http(route, address, cookies,
+                                            item_ids, 4, concurrency=2)
+                    self.assertEqual(result['latency']['count'], 4)
+                    self.assertEqual(result['errors'], 0)
+
+
+"""
+Concurrent writers should wait for each other instead of failing with
+"database is locked", even when a transaction reads before it writes
+"""
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection profile')
+class ConcurrentWriteTests(TransactionTestCase):
+
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+    def test_read_then_write_transactions(self):
+        items = [make_item(f'Item {number}') for number in range(4)]
+        users = [User.objects.create_user(f'writer{number}')
+                 for number in range(8)]
+
+        def write(user):
+            for item in items * 5:
+                with transaction.atomic():
+                    # The read would make a deferred transaction fail when
+                    # it upgrades to a write lock held by another thread
+                    line = CartDetails.objects.filter(
+                        user=user, item=item).first()
+                    if line is None:
+                        CartDetails.objects.create(user=user, item=item)
+                    else:
+                        line.quantity += 1
+                        line.save()
+
+        self.assertEqual(run_in_threads(write, users), [])
+        self.assertEqual(CartDetails.objects.count(), 8 * 4)
+        self.assertEqual(CartDetails.objects.aggregate(
+            total=Sum('quantity'))['total'], 8 * 4 * 5)
+
+
+"""
+The read pages are async views and still require a login where they did
+"""
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='secret')
+        Address.objects.create(user=self.user.profile, city='Manila')
+        self.item = make_item('Shirt', '10.00')
+
+    def test_read_views_are_async(self):
+        for view in (views.index, views.item_view, views.orders_view,
+                     views.profile_view):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    def test_login_required(self):
+        for url in ('/my-orders', '/profile/'):
+            response = self.client.get(url)
+            self.assertRedirects(response, f'/accounts/login/?next={url}',
+                                 fetch_redirect_response=False)
+
+    def test_pages_render(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get('/'), 'Shirt')
+        self.assertContains(self.client.get(f'/item/{self.item.item_id}/'),
+                            'Shirt')
+        self.assertContains(self.client.get('/profile/'), 'Manila')
+        self.assertEqual(self.client.get('/my-orders').status_code, 200)
+        self.assertEqual(self.client.get('/item/0/').status_code, 404)
+
+
+"""
+Checkout and signup queue their side effects as durable jobs
+"""
+
+
+flaky_calls = []
+
+
+def flaky(fail_times):
+    flaky_calls.append(fail_times)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError('flaky task')
+
+
+@override_settings(TASK_RUNNER='worker')
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        flaky_calls.clear()
+
+    def run_due(self):
+        call_command('run_workers', once=True, threads=1, stdout=StringIO())
+
+    def test_checkout_queues_confirmation_and_reconciliation(self):
+        user = User.objects.create_user('buyer', email='buyer@example.com')
+        item = make_item('Shirt', '10.00', quantity_stock=10)
+        CartDetails.objects.create(user=user, item=item, quantity=2)
+        Item.objects.filter(pk=item.pk).update(quantity_order=5)  # drifted
+
+        order = place_order(user)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 2)
+        self.assertEqual(mail.outbox, [])
+
+        with self.assertLogs('pages.tasks', 'WARNING'):
+            self.run_due()
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+        self.assertEqual(mail.outbox[0].subject,
+                         f'Your order no. {order.order_id}')
+        self.assertIn('2 x Shirt', mail.outbox[0].body)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity_order, 2)
+
+    def test_shipping_takes_the_units_off_the_stock(self):
+        user = User.objects.create_user('buyer')
+        item = make_item('Shirt', '10.00', quantity_stock=10)
+        CartDetails.objects.create(user=user, item=item, quantity=3)
+        order = place_order(user)
+
+        order.status = 'S'
+        order.save()
+        tasks.reconcile_inventory(order.order_id)
+        item.refresh_from_db()
+        self.assertEqual((item.quantity_stock, item.quantity_order), (7, 0))
+
+        order.status = 'D'
+        order.save()
+        self.assertEqual(Item.objects.get().quantity_stock, 7)
+        order.status = 'P'  # back to processing returns the units
+        order.save()
+        tasks.reconcile_inventory(order.order_id)
+        item.refresh_from_db()
+        self.assertEqual((item.quantity_stock, item.quantity_order), (10, 3))
+
+    def test_reconciliation_skips_shipped_orders(self):
+        user = User.objects.create_user('buyer')
+        item = make_item('Shirt', '10.00', quantity_stock=10)
+        shipped = Order.objects.create(user=user.profile, status='S')
+        OrderDetails.objects.create(order_id=shipped, item=item, quantity=4,
+                                    unit_price=item.price, item_name='Shirt')
+        CartDetails.objects.create(user=user, item=item, quantity=3)
+        order = place_order(user)
+
+        tasks.reconcile_inventory(order.order_id)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity_order, 3)
+
+    def test_idempotency_key(self):
+        first = tasks.enqueue(flaky, 0, key='once')
+        second = tasks.enqueue(flaky, 0, key='once')
+        self.assertEqual(first.job_id, second.job_id)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_failures_are_retried_then_given_up(self):
+        job = tasks.enqueue(flaky, 1)
+        with self.assertLogs('pages.tasks', 'ERROR'):
+            self.assertIsNotNone(tasks.run_job(job.job_id))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('flaky task', job.last_error)
+
+        Job.objects.update(run_at=job.created_date)  # retry is due
+        self.assertIsNone(tasks.run_job(job.job_id))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 2))
+
+        flaky_calls.clear()
+        job = tasks.enqueue(flaky, 10)
+        for attempt in range(job.max_attempts):
+            Job.objects.filter(pk=job.pk).update(run_at=job.created_date)
+            with self.assertLogs('pages.tasks', 'ERROR'):
+                tasks.run_job(job.job_id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_claimed_job_runs_once(self):
+        job = tasks.enqueue(flaky, 0)
+        self.assertTrue(tasks.claim(job.job_id))
+        self.assertFalse(tasks.claim(job.job_id))
+
+    def test_signup_queues_profile_setup(self):
+        self.client.post('/signup/', {
+            'username': 'newbie', 'email': 'newbie@example.com',
+            'password1': 'a-long-Passw0rd', 'password2': 'a-long-Passw0rd',
+            'birth_date': '2000-01-01', 'address_line_1': 'Street 1',
+            'city': 'Manila', 'country': 'Philippines', 'zip_code': '1000',
+        })
+        user = User.objects.get()
+        self.assertEqual(Job.objects.get().key, f'profile-setup:{user.pk}')
+        self.assertFalse(Address.objects.exists())
+
+        self.run_due()
+        self.assertEqual(mail.outbox[0].to, ['newbie@example.com'])
+        self.assertEqual(Address.objects.get(user=user.profile).city,
+                         'Manila')
+
+
+"""
+Signup creates the user and profile with one write each and queues the
+rest
+"""
+
+
+class SignupTests(TestCase):
+
+    form = {
+        'username': 'newbie', 'email': 'newbie@example.com',
+        'password1': 'a-long-Passw0rd', 'password2': 'a-long-Passw0rd',
+        'birth_date': '2000-01-01', 'address_line_1': 'Street 1',
+        'city': 'Manila', 'country': 'Philippines', 'zip_code': '1000',
+    }
+
+    def test_signup_writes(self):
+        encode = mock.patch.object(
+            PBKDF2PasswordHasher, 'encode', autospec=True,
+            side_effect=PBKDF2PasswordHasher.encode)
+        with encode as hashed, CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/signup/', self.form)
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(hashed.call_count, 1)
+
+        # Writes of the shop, the session writes belong to login()
+        writes = [query['sql'].split()[:3] for query in queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE'))
+                  and 'django_session' not in query['sql']]
+        self.assertEqual(writes, [
+            ['INSERT', 'INTO', '"auth_user"'],
+            ['INSERT', 'INTO', '"pages_profile"'],
+            ['INSERT', 'INTO', '"pages_job"'],
+            ['UPDATE', '"auth_user"', 'SET'],  # last_login
+        ])
+        self.assertEqual(len(queries), 16)
+
+        user = User.objects.select_related('profile').get()
+        self.assertEqual(str(user.profile.birth_date), '2000-01-01')
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+
+    def test_profile_saved_only_when_changed(self):
+        user = User.objects.create_user('shopper')
+        user = User.objects.select_related('profile').get(pk=user.pk)
+        with self.assertNumQueries(1):
+            user.save()  # the profile is unchanged
+
+        user.profile.birth_date = date(1990, 5, 17)
+        with self.assertNumQueries(2):
+            user.save()
+        self.assertEqual(Profile.objects.get().birth_date, date(1990, 5, 17))
+
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(1):
+            user.save()  # the profile was never loaded
+
+
+"""
+Staff can stream orders, order lines and item sales as CSV or JSON Lines
+"""
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('finance', is_staff=True)
+        self.client.force_login(self.user)
+        shirt = make_item('Shirt', '10.00')
+        for quantity in (1, 2):
+            order = Order.objects.create(
+                user=self.user.profile, total=10 * quantity, line_count=1)
+            OrderDetails.objects.create(
+                order_id=order, item=shirt, quantity=quantity,
+                unit_price=shirt.price, item_name=shirt.name)
+
+    def lines(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_orders_as_jsonl(self):
+        rows = [json.loads(line)
+                for line in self.lines('/exports/orders.jsonl')]
+        self.assertEqual([(row['username'], row['total'], row['line_count'])
+                          for row in rows],
+                         [('finance', '10.00', 1), ('finance', '20.00', 1)])
+
+    def test_item_sales(self):
+        self.assertEqual(self.lines('/exports/item-sales.csv'), [
+            'item,item_name,orders,units,revenue',
+            f'{Item.objects.get().pk},Shirt,2,3,30.00',
+        ])
+
+    def test_export_under_asgi(self):
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/exports/orders.csv',
+            'query_string': b'', 'headers': [
+                (b'host', b'testserver'),
+                (b'cookie', f'sessionid={self.client.session.session_key}'
+                            .encode())],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # Like the test client, keep the test transaction's connection open
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(asgi.application)(scope, receive, send)
+        finally:
+            signals.request_started.connect(close_old_connections)
+            signals.request_finished.connect(close_old_connections)
+
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual(len(body.decode().splitlines()), 3)
+
+    def test_staff_only_and_unknown_exports(self):
+        self.assertEqual(
+            self.client.get('/exports/orders.xml').status_code, 404)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(
+            self.client.get('/exports/orders.csv').status_code, 302)
+
+    def test_command(self):
+        output = StringIO()
+        call_command('export_report', 'order-lines', format='jsonl',
+                     chunk_size=1, stdout=output)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([row['quantity'] for row in rows], [1, 2])
+
+
+"""
+The catalogue import upserts items by name in batches
+"""
+
+
+class CatalogueImportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.scarf = make_item('Scarf', '7.00', description='Wool')
+
+    def test_creates_updates_and_rejects_rows(self):
+        cache.set(f'item-page:{self.scarf.pk}', 'stale')
+        rows = imports.csv_rows(StringIO(
+            'name,price,stock\n'
+            'Scarf,8.50,4\n'
+            'Parka,120.00,2\n'
+            ',1.00,1\n'
+            'Boots,cheap,-1\n'
+            'Parka,110.00,3\n'))
+
+        # Savepoint, lookup, update, insert, read back, 2 for the search
+        # index and release, for any number of rows in the batch
+        with self.assertNumQueries(8):
+            report = imports.import_items(rows, batch_size=10)
+
+        self.assertEqual((report.created, report.updated), (1, 1))
+        self.assertEqual([number for number, _ in report.errors], [3, 4])
+        self.assertIn('stock:', report.errors[1][1])
+
+        self.scarf.refresh_from_db()
+        self.assertEqual((self.scarf.price, self.scarf.quantity_stock,
+                          self.scarf.description, self.scarf.version),
+                         (Decimal('8.50'), 4, 'Wool', 2))
+        parka = Item.objects.get(name='Parka')
+        self.assertEqual((parka.price, parka.quantity_stock),
+                         (Decimal('110.00'), 3))
+        self.assertIsNone(cache.get(f'item-page:{self.scarf.pk}'))
+        self.assertEqual([item.name for item in search.search('parka')],
+                         ['Parka'])
+
+    def test_command_reads_jsonl_in_batches(self):
+        path = Path(tempfile.mkdtemp()) / 'items.jsonl'
+        self.addCleanup(shutil.rmtree, path.parent)
+        path.write_text('\n'.join(json.dumps(
+            {'name': f'Sock {number}', 'price': 2.5, 'stock': number})
+            for number in range(5)) + '\nnot json\n')
+
+        output, progress = StringIO(), StringIO()
+        call_command('import_catalogue', str(path), batch_size=2,
+                     stdout=output, stderr=progress)
+
+        self.assertEqual(Item.objects.filter(name__startswith='Sock').count(),
+                         5)
+        self.assertEqual(progress.getvalue().count(' rows: '), 3)
+        self.assertIn('Row 6:', progress.getvalue())
+        self.assertIn('5 created, 0 updated, 1 rejected', output.getvalue())
+
+
+"""
+Admin changelists cost a fixed number of queries and estimate big counts
+"""
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.users = [User.objects.create_user(f'buyer{number}')
+                      for number in range(5)]
+        self.item = make_item('Hat', '12.00')
+
+    def add_orders(self, count):
+        for number in range(count):
+            user = self.users[number % len(self.users)]
+            order = Order.objects.create(user=user.profile, total=12,
+                                         line_count=1)
+            OrderDetails.objects.create(order_id=order, item=self.item,
+                                        unit_price=12, item_name='Hat')
+            Address.objects.create(user=user.profile)
+            CartDetails.objects.get_or_create(user=user, item=self.item)
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_changelists_take_a_fixed_number_of_queries(self):
+        urls = ['/admin/pages/order/', '/admin/pages/order/?status=S',
+                '/admin/pages/orderdetails/', '/admin/pages/address/',
+                '/admin/pages/cartdetails/']
+        self.add_orders(10)
+        few = [self.queries(url) for url in urls]
+        self.add_orders(90)
+        self.assertEqual([self.queries(url) for url in urls], few)
+        self.assertLessEqual(max(few), 8)
+
+    def test_searches_use_an_index(self):
+        self.add_orders(5)
+        searches = [(Profile, 'buyer1'), (Address, 'buyer1'),
+                    (Address, '1000'), (CartDetails, 'buyer1'),
+                    (Item, 'Hat'), (Order, 'buyer1'), (Order, '3'),
+                    (OrderDetails, 'Hat'), (OrderDetails, '3'),
+                    (Review, 'buyer1'), (Job, 'key'), (Item, 'Wool scarf')]
+        for model, term in searches:
+            model_admin = shop_admin.admin.site._registry[model]
+            request = RequestFactory().get('/', {'q': term})
+            queryset, _ = model_admin.get_search_results(
+                request, model.objects.all(), term)
+            self.assertNotIn('SCAN', queryset.explain(), (model, term))
+
+    def test_search(self):
+        self.add_orders(5)
+        order = Order.objects.first()
+        for term, count in (('buyer1', 1), (str(order.pk), 1), ('buyer', 5),
+                            ('Buyer1', 0), (f'buyer1 {order.pk}', 0)):
+            response = self.client.get('/admin/pages/order/', {'q': term})
+            self.assertEqual(len(response.context['cl'].result_list), count,
+                             term)
+
+    def test_multi_word_names_and_autocomplete(self):
+        scarf = make_item('Wool scarf', '15.00')
+        make_item('Wool', '1.00')
+        for term, names in (('Wool', ['Wool', 'Wool scarf']),
+                            ('Wool s', ['Wool scarf']),
+                            ('Wool scarf', ['Wool scarf']),
+                            ('Wool scarves', [])):
+            response = self.client.get('/admin/pages/item/autocomplete/',
+                                       {'term': term})
+            self.assertEqual(
+                sorted(result['text'] for result in response.json()['results']),
+                names, term)
+
+        response = self.client.get('/admin/pages/item/', {'q': 'Wool scarf'})
+        self.assertEqual(list(response.context['cl'].result_list), [scarf])
+
+    def test_big_tables_are_counted_from_the_statistics(self):
+        self.add_orders(3)
+        Order.objects.filter(pk=Order.objects.first().pk).delete()
+
+        with mock.patch.object(shop_admin, 'ESTIMATE_THRESHOLD', 1):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get('/admin/pages/order/')
+        self.assertFalse([query for query in context.captured_queries
+                          if 'COUNT(' in query['sql']])
+        # The largest id, the deleted order is still counted
+        self.assertContains(response, '3 orders')
+
+        response = self.client.get('/admin/pages/order/')
+        self.assertContains(response, '2 orders')
+
+
+"""
+collectstatic bundles, hashes and compresses the assets, which are then
+served with immutable cache headers
+"""
+
+
+class StaticPipelineTests(TestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = self.settings(STATIC_ROOT=str(self.root / 'root'),
+                                 STATIC_BUNDLE_ROOT=self.root / 'bundles')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if response.streaming:
+            # Reading the whole file also closes it
+            response.body = b''.join(response.streaming_content)
+        return response
+
+    def test_minify_css(self):
+        self.assertEqual(
+            staticfiles.minify_css('/* header */\n.a > b,\n.c {\n'
+                                   '  color: red;\n  margin: 0 auto;\n}\n'),
+            '.a>b,.c{color:red;margin:0 auto}\n')
+
+    def test_unbuilt_assets_fall_back_to_their_names(self):
+        self.assertContains(self.get('/'), '/static/css/home.bundle.css')
+
+    def test_build_and_serve(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        response = self.get('/')
+        bundle = re.search(r'/static/css/home\.bundle\.[0-9a-f]{12}\.css',
+                           response.content.decode()).group()
+
+        response = self.get(bundle, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        css = gzip.decompress(response.body).decode()
+        self.assertIn('.wrapper{', css)  # from base.css
+        self.assertIn('.pagination', css)  # from home.css
+        self.assertNotIn('/*', css)
+
+        response = self.get(bundle)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Type'], 'text/css')
+
+        response = self.get('/static/css/home.bundle.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        response = self.get('/static/css/home.bundle.css',
+                            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        self.assertEqual(self.get('/static/../manage.py').status_code, 404)
@@ -1,11 +1,26 @@
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest,
+    JsonResponse, StreamingHttpResponse)
 from django.template import loader
-from django.contrib.auth import login, authenticate
+from django.contrib import messages
+from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from myapp.forms import SignUpForm, ReviewForm
+from django.contrib.admin.views.decorators import staff_member_required
+from asgiref.sync import sync_to_async
+from myapp.forms import SignUpForm, ReviewForm, CatalogueForm, SearchForm
 import operator
+from . import catalogue, exports, search, stats
+from .accounts import register
+from .cache import (
+    FRAGMENT_CACHE_TIMEOUT, catalogue_validators, get_item_page,
+    item_validators)
+from .cart import get_cart
+from .checkout import EmptyCart, place_order
+from .decorators import async_condition, async_login_required
+from .stock import OutOfStock
 # import for the models needed
 from .models import CartDetails, Profile, Item, Address, Review, Order, OrderDetails
 
@@ -15,14 +30,16 @@ Require users to login to view this page, redirect if not.
 """
 
 
-@login_required(login_url='/accounts/login/')
-def profile_view(request, *args, **kwargs):
-    address = Address.objects.get(user=request.user.profile)
+@async_login_required(login_url='/accounts/login/')
+async def profile_view(request, *args, **kwargs):
+    # None until the signup job has created it
+    address = await sync_to_async(
+        lambda: Address.objects.filter(user=request.user.profile).first())()
     context = {
         "address": address,
         "title": "Shop: My Profile"
     }
-    return render(request, "profile.html", context)
+    return await sync_to_async(render)(request, "profile.html", context)
 
 
 """ 
@@ -36,27 +53,73 @@ def about_view(request):
 
 """ 
 Main/home page that displays the items on sale.
+The read views are async: the database work and the rendering (which loads
+request.user) run through sync_to_async, so under ASGI the worker serves
+other requests while they wait.
+Requests revalidating an unchanged catalogue get a 304 without rendering.
 """
 
 
-def index(request, *args, **kwargs):
+@async_condition(catalogue_validators)
+async def index(request, *args, **kwargs):
 
-    # If sort request is received from user
-    if request.method == 'GET' and 'filter' in request.GET:
-        print('Request made.')
-        filter_req = request.GET['filter']
-        all_items = Item.objects.order_by(filter_req)
+    # Validate the sort and filters before touching the database
+    form = CatalogueForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest('Invalid sort or filter.')
 
-    # No sort then sort by default alphabetical
-    else:
-        all_items = Item.objects.order_by("name")
+    options = form.cleaned_data
+    sort = options.pop('filter')
+    items = catalogue.filter_items(Item.objects.all(), **options)
+
+    # Fetch a single page of items after/before the cursor if one is given
+    try:
+        page = await sync_to_async(catalogue.paginate)(
+            items, sort,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+    except catalogue.InvalidCursor:
+        return HttpResponseBadRequest('Invalid page cursor.')
+
+    # Query string of the current sort and filters for the page links
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
 
     context = {
-        'all_items': all_items,
+        'all_items': page,
+        'page': page,
+        'form': form,
+        'sort': sort,
+        'query': query.urlencode(),
+        'fragment_timeout': FRAGMENT_CACHE_TIMEOUT,
         'title': 'Shop'
     }
 
-    return render(request, "home.html", context)
+    return await sync_to_async(render)(request, "home.html", context)
+
+
+""" 
+Search results for the terms typed in the search box, best match first.
+"""
+
+
+def search_view(request):
+    form = SearchForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest('Invalid search.')
+
+    query = form.cleaned_data['q']
+    results = search.search(query, form.cleaned_data['page'])
+
+    context = {
+        'results': results,
+        'query': query,
+        'title': f'Shop: {query}' if query else 'Shop: Search',
+    }
+
+    return render(request, "search.html", context)
 
 
 """ 
@@ -73,26 +136,23 @@ def signup(request):
 
         # Check if the form is valid
         if form.is_valid():
-            user = form.save()
-            user.refresh_from_db()  # load the profile instance created by the signal
-            # Adding the address inputs
-            address = Address.objects.create(
-                user=user.profile,
-                address_line_1=form.cleaned_data.get('address_line_1'),
-                address_line_2=form.cleaned_data.get('address_line_2'),
-                city=form.cleaned_data.get('city'),
-                country=form.cleaned_data.get('country'),
-                zip_code=form.cleaned_data.get('zip_code'),
+            data = form.cleaned_data
+            user = register(
+                username=data['username'],
+                password=data['password1'],
+                email=data.get('email', ''),
+                first_name=data.get('first_name', ''),
+                last_name=data.get('last_name', ''),
+                birth_date=data.get('birth_date'),
+                address_line_1=data.get('address_line_1'),
+                address_line_2=data.get('address_line_2'),
+                city=data.get('city'),
+                country=data.get('country'),
+                zip_code=data.get('zip_code'),
             )
-            # Save the birthdate
-            user.profile.birth_date = form.cleaned_data.get("birth_date")
-            address.save()
-            user.save()
-
-            raw_password = form.cleaned_data.get('password1')
 
-            # Login the new user
-            user = authenticate(username=user.username, password=raw_password)
+            # Login the new user, the password was just set so there is no
+            # need to authenticate (and hash it) again
             login(request, user)
 
             return redirect('home')
@@ -108,18 +168,8 @@ Add items to cart.
 """
 
 
-@login_required(login_url='/accounts/login/')
 def add_cart(request, item_id):
-
-    item = Item.objects.get(item_id=item_id)  # retreive item from database
-    cart, cart_created = CartDetails.objects.get_or_create(
-        item=item, user=request.user)  # get or create a cart for the user
-
-    # if a new cart was not created then increment the quantity
-    if not cart_created:
-        cart.quantity += 1
-        cart.save()
-
+    get_cart(request).add(item_id)  # buffered in the session
     return redirect('/my-cart')
 
 
@@ -128,68 +178,37 @@ View all items in cart
 """
 
 
-@login_required(login_url='/accounts/login/')
 def cart_view(request):
+    lines, total = get_cart(request).summary()
 
-    # check if a cart for the user exists
-    if CartDetails.objects.filter(user=request.user).exists():
-        cart = CartDetails.objects.filter(
-            user=request.user)  # lll the user's carts
-
-        cart_items = []  # list of items
-        quantity = []  # list of corresponding quantities for the items
-        subtotal = []  # list of corresponding subtotals for the items
-
-        # Go through each item in the collection of carts and append to the lists
-        for cart_item in cart:
-            cart_items.append(cart_item.item)
-            quantity.append(cart_item.quantity)
-            subtotal.append(cart_item.item.price * cart_item.quantity)
-
-        # Zip the lists to pass to frontend
-        cart_quantity = zip(cart_items, quantity, subtotal)
-
-        context = {
-            'cart': cart_quantity,
-            'total': sum(subtotal),
-            'title': 'Shop: My Cart'
-        }
-
-    # If no cart exists
-    else:
-        context = {
-            'title': 'Shop: My Cart'
-        }
+    context = {
+        'cart': lines,
+        'total': total,
+        'title': 'Shop: My Cart'
+    }
 
     return render(request, "cart.html", context)
 
 
 """ 
-A page for viewing a single item and passing the item details and reviews
+A page for viewing a single item and passing the item details and reviews.
+Unchanged items are answered with a 304 like the catalogue.
 """
 
 
-def item_view(request, item_id):
-    item = Item.objects.get(item_id=item_id)  # get the item by the item_id
-
-    # Check if there are reviews available for the item.
-    if Review.objects.filter(item=item).exists():
-        reviews = Review.objects.filter(item=item)
-
-        context = {
-            "item": item,
-            "reviews": reviews,
-            "title": item.name
-        }
+@async_condition(item_validators)
+async def item_view(request, item_id):
+    # The item and its reviews come from the cache, 2 queries on a miss
+    item, reviews = await sync_to_async(get_item_page)(item_id)
 
-    # If there are no reviews
-    else:
-        context = {
-            "item": item,
-            "title": item.name
-        }
+    context = {
+        "item": item,
+        "reviews": reviews,
+        "fragment_timeout": FRAGMENT_CACHE_TIMEOUT,
+        "title": item.name
+    }
 
-    return render(request, "item.html", context)
+    return await sync_to_async(render)(request, "item.html", context)
 
 
 """ 
@@ -197,22 +216,8 @@ Remove an item from user's cart
 """
 
 
-@login_required(login_url='/accounts/login/')
 def remove_item(request, item_id):
-    item = Item.objects.get(item_id=item_id)  # get the item
-
-    cart = CartDetails.objects.get(
-        user=request.user, item=item)  # get the cart
-
-    # If only one of the item is in the cart then delete the cart
-    if cart.quantity == 1:
-        cart.delete()
-
-    # Else more than one then decrement
-    else:
-        cart.quantity -= 1
-        cart.save()
-
+    get_cart(request).remove(item_id)
     return redirect('/my-cart')
 
 
@@ -223,35 +228,25 @@ View for the confirmation checkout page
 
 @login_required(login_url='/accounts/login/')
 def checkout_view(request):
-    order = Order.objects.create(
-        user=request.user.profile)  # Create a new order
-    cart = CartDetails.objects.filter(
-        user=request.user)  # Get the current user's cart
-
-    order_details = []  # List for each item/order_details
-    subtotals = []  # Subtotal for each item/order_detail
-
-    # Go through each item in the cart and create order_details for each.
-    # and append the details to the list for the frontend
-    for item_cart in cart:
-        order_item = OrderDetails.objects.create(
-            order_id=order,
-            item=item_cart.item,
-            quantity=item_cart.quantity,
-        )
-        subtotals.append(item_cart.item.price * item_cart.quantity)
-        order_details.append(order_item)
-
-    # Zip for frontend
-    order_subtotal = zip(order_details, subtotals)
-
-    # Delete the cart since checkout
-    cart.delete()
+    # Write the buffered cart back, then turn it into an order
+    cart = get_cart(request)
+    cart.flush()
+    try:
+        order = place_order(request.user)
+    except EmptyCart:
+        return redirect('/my-cart')
+    except OutOfStock as error:
+        names = Item.objects.filter(
+            pk__in=error.item_ids).values_list('name', flat=True)
+        messages.error(
+            request, f"Not enough stock left for: {', '.join(names)}")
+        return redirect('/my-cart')
+    cart.clear()
 
     context = {
         "order_num": order.order_id,
-        "order": order_subtotal,
-        "total": sum(subtotals),
+        "order": order.lines,
+        "total": order.total,
         "title": f"Order no: {order.order_id}",
     }
 
@@ -263,40 +258,19 @@ View for all the user's orders
 """
 
 
-@login_required(login_url='/accounts/login/')
-def orders_view(request):
-    all_orders = Order.objects.filter(
-        user=request.user.profile).order_by('-created_date')  # Get all the orders sorted by recency
-
-    order_ids = []  # List for Order IDs
-    order_status = []  # List for Order Status
-    order_collect = []  # Lists of Order Details for each order (list of lists)
-    totals = []  # Totals for each order
-
-    # Get each order_detail in all the user's orders
-    for orders in all_orders:
-        order_ids.append(orders.order_id)  # Append order_id
-        order_status.append(orders.get_status)  # Append order status
-        # Get all the order_details under this order_id
-        order = OrderDetails.objects.filter(order_id=orders.order_id)
-
-        single_order = []  # List for all the order_details
-        total_order = 0  # Total for the order
-
-        # Go through each item in the order and append
-        for item in order:
-            single_order.append(item)
-            total_order += int(item.get_subtotal())
-
-        order_collect.append(single_order)
-        totals.append(total_order)
+@async_login_required(login_url='/accounts/login/')
+async def orders_view(request):
+    # Orders, order lines and items are loaded in a fixed number of queries,
+    # the orders with the totals stored at checkout
+    all_orders = await sync_to_async(lambda: list(
+        Order.objects.history_for(request.user.profile)))()
 
     context = {
-        "orders": zip(order_ids, order_status, order_collect, totals),
+        "orders": all_orders,
         "title": "Shop: My Orders",
     }
 
-    return render(request, "my-orders.html", context)
+    return await sync_to_async(render)(request, "my-orders.html", context)
 
 
 """ 
@@ -330,3 +304,38 @@ def review_view(request, item_id):
         }
 
     return render(request, "review-item.html", context)
+
+
+""" 
+Query count and latency percentiles of every page, for staff only
+"""
+
+
+@staff_member_required
+def stats_view(request):
+    return JsonResponse(stats.histogram.snapshot())
+
+
+""" 
+Orders, order lines or item sales as CSV or JSON Lines, streamed, for
+staff only. Under ASGI the export is streamed from a temporary file.
+"""
+
+
+@staff_member_required
+def export_view(request, name, format):
+    if name not in exports.EXPORTS or format not in exports.FORMATS:
+        raise Http404('Unknown export')
+
+    _, content_type = exports.FORMATS[format]
+    if isinstance(request, ASGIRequest):
+        # Read here, in the view's thread, not by the event loop
+        response = FileResponse(
+            exports.export_file(name, format), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            exports.export_lines(name, format), content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="{name}.{format}"')
+    response['X-Accel-Buffering'] = 'no'  # no proxy buffering either
+    return response